@@ -0,0 +1,161 @@
+# BACKEND/admission.py
+"""
+Admission control for the inference path of a worker.
+
+At most `max_in_flight` inferences run at once. Further requests wait in a
+short queue that is served round-robin across users, so one bulk uploader
+cannot monopolize the model. A request is refused up front (503 with
+Retry-After) when its expected wait, estimated from an EWMA of recent
+service times and the requests ahead of it, would exceed the latency budget,
+and it gives up with the same answer if it is still waiting once the budget
+has passed.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 1))
+MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 4))
+MAX_QUEUED_PER_USER = int(os.getenv('ADMISSION_MAX_QUEUED_PER_USER', 2))
+LATENCY_BUDGET = float(os.getenv('ADMISSION_LATENCY_BUDGET', 10.0))  # seconds
+INITIAL_SERVICE_TIME = float(os.getenv('ADMISSION_INITIAL_SERVICE_TIME', 0.5))  # seconds
+EWMA_WEIGHT = 0.2
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; carries the Retry-After hint in seconds."""
+
+    def __init__(self, retry_after, msg):
+        super().__init__(msg)
+        self.retry_after = retry_after
+        self.msg = msg
+
+
+class _Ticket:
+    __slots__ = ('user', 'granted')
+
+    def __init__(self, user):
+        self.user = user
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE,
+                 max_queued_per_user=MAX_QUEUED_PER_USER, latency_budget=LATENCY_BUDGET):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.latency_budget = latency_budget
+        self.service_time = INITIAL_SERVICE_TIME
+        self._in_flight = 0
+        self._queued = 0
+        # user -> deque of waiting tickets; the first user is next in the round-robin
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+        self._stats = {"admitted": 0, "waited": 0, "rejected": 0, "timed_out": 0}
+
+    # --- Wait estimate ---
+    def _requests_ahead(self, user):
+        """Waiters that round-robin service would admit before a new ticket from `user`."""
+        own = len(self._queues.get(user, ()))
+        return own + sum(min(len(queue), own + 1) for other, queue in self._queues.items() if other != user)
+
+    def _expected_wait(self, ahead):
+        # Everything ahead of us, plus the running inferences, shares max_in_flight slots.
+        return (ahead + self._in_flight) / self.max_in_flight * self.service_time
+
+    def _retry_after(self):
+        return max(1, math.ceil((self._queued + self._in_flight) / self.max_in_flight * self.service_time))
+
+    def _reject(self, reason):
+        self._stats["rejected"] += 1
+        return Overloaded(self._retry_after(), reason)
+
+    # --- Admission ---
+    def acquire(self, user):
+        """Blocks until `user` may run an inference, or raises Overloaded."""
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._queues:
+                self._in_flight += 1
+                self._stats["admitted"] += 1
+                return
+
+            if self._queued >= self.max_queue:
+                raise self._reject("The server is busy. Please try again shortly.")
+            if len(self._queues.get(user, ())) >= self.max_queued_per_user:
+                raise self._reject("You already have scans waiting to be analyzed. Please wait for them to finish.")
+            if self._expected_wait(self._requests_ahead(user)) > self.latency_budget:
+                raise self._reject("The server is busy. Please try again shortly.")
+
+            ticket = _Ticket(user)
+            self._queues.setdefault(user, deque()).append(ticket)
+            self._queued += 1
+            self._stats["waited"] += 1
+
+            deadline = time.monotonic() + self.latency_budget
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(ticket)
+                    self._stats["timed_out"] += 1
+                    raise self._reject("The server is busy. Please try again shortly.")
+                self._cond.wait(remaining)
+            self._stats["admitted"] += 1
+
+    def _withdraw(self, ticket):
+        queue = self._queues.get(ticket.user)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._queues[ticket.user]
+
+    def release(self, service_time=None):
+        """Frees a slot and hands it to the next user in round-robin order."""
+        with self._cond:
+            self._in_flight -= 1
+            if service_time is not None:
+                self.service_time += EWMA_WEIGHT * (service_time - self.service_time)
+            while self._queues and self._in_flight < self.max_in_flight:
+                user, queue = next(iter(self._queues.items()))
+                ticket = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(user)
+                else:
+                    del self._queues[user]
+                ticket.granted = True
+                self._in_flight += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, user):
+        """Holds an inference slot for the enclosed block (raises Overloaded if shed)."""
+        self.acquire(user)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def describe(self):
+        with self._cond:
+            return {
+                "pid": os.getpid(),
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "max_queued_per_user": self.max_queued_per_user,
+                "latency_budget": self.latency_budget,
+                "service_time_ewma": round(self.service_time, 4),
+                "in_flight": self._in_flight,
+                "waiting": self._queued,
+                "waiting_users": len(self._queues),
+                **self._stats,
+            }
+
+
+# Shared per-process controller for the inference routes
+inference_admission = AdmissionController()
@@ -0,0 +1,176 @@
+# BACKEND/analytics.py
+"""
+Hourly and daily rollups of predictions for the admin analytics API.
+
+Every prediction increments a handful of counters in `prediction_rollups`:
+one document per (granularity, bucket start, organization), plus the
+clinic-wide document with organization None. Dashboard queries then read at
+most one document per bucket instead of scanning `predictions`.
+
+    python analytics.py rebuild    # recompute every rollup from predictions
+"""
+import argparse
+import datetime
+import os
+
+from pymongo import ASCENDING, UpdateOne
+
+ROLLUP_COLLECTION = 'prediction_rollups'
+GRANULARITIES = ('hour', 'day')
+# Tumor probability histogram: 10 bins of 10 percentage points each
+HISTOGRAM_BINS = 10
+TUMOR_RESULT = "Tumor Detected"
+
+_indexes_ready = False
+
+
+def bucket_start(date, granularity):
+    if granularity == 'hour':
+        return date.replace(minute=0, second=0, microsecond=0)
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def parse_confidence(confidence):
+    """Turns the stored "xx.xx%" string back into a 0..1 probability (None if unreadable)."""
+    try:
+        return float(str(confidence).rstrip('%')) / 100
+    except (TypeError, ValueError):
+        return None
+
+
+def _histogram_bin(probability):
+    return min(int(probability * HISTOGRAM_BINS), HISTOGRAM_BINS - 1)
+
+
+def rollup_increments(prediction):
+    """Returns the $inc document one prediction contributes to its buckets."""
+    inc = {"uploads": 1, "tumor": 1 if prediction.get("result") == TUMOR_RESULT else 0}
+    probability = parse_confidence(prediction.get("confidence"))
+    if probability is not None:
+        inc["confidence_sum"] = probability
+        inc["confidence_count"] = 1
+        inc[f"histogram.{_histogram_bin(probability)}"] = 1
+    return inc
+
+
+def rollup_operations(predictions):
+    """Groups predictions by bucket and returns one upsert per touched rollup document."""
+    increments = {}
+    for prediction in predictions:
+        date = prediction.get("date")
+        if not isinstance(date, datetime.datetime):
+            continue
+        inc = rollup_increments(prediction)
+        organizations = {None, prediction.get("organization") or None}
+        for granularity in GRANULARITIES:
+            for organization in organizations:
+                key = (granularity, bucket_start(date, granularity), organization)
+                total = increments.setdefault(key, {})
+                for field, value in inc.items():
+                    total[field] = total.get(field, 0) + value
+
+    return [
+        UpdateOne(
+            {"granularity": granularity, "bucket": bucket, "organization": organization},
+            {"$inc": inc},
+            upsert=True,
+        )
+        for (granularity, bucket, organization), inc in increments.items()
+    ]
+
+
+def record_predictions(db, predictions):
+    """Adds newly stored predictions to the rollups in one round trip."""
+    global _indexes_ready
+    operations = rollup_operations(predictions)
+    if not operations:
+        return
+    if not _indexes_ready:
+        # The unique index keeps concurrent upserts from different workers on one document
+        ensure_indexes(db)
+        _indexes_ready = True
+    db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+
+def record_prediction(db, prediction):
+    record_predictions(db, [prediction])
+
+
+def ensure_indexes(db):
+    db[ROLLUP_COLLECTION].create_index(
+        [("granularity", ASCENDING), ("organization", ASCENDING), ("bucket", ASCENDING)], unique=True
+    )
+
+
+def read_rollups(db, granularity, start, end, organization=None):
+    """Returns the summary series for buckets in [start, end), oldest first."""
+    docs = db[ROLLUP_COLLECTION].find(
+        {"granularity": granularity, "organization": organization, "bucket": {"$gte": start, "$lt": end}},
+        {"_id": 0},
+    ).sort("bucket", ASCENDING)
+
+    series = []
+    for doc in docs:
+        uploads = doc.get("uploads", 0)
+        histogram = doc.get("histogram", {})
+        confidence_count = doc.get("confidence_count", 0)
+        series.append({
+            "bucket": doc["bucket"].strftime("%Y-%m-%d %H:%M:%S"),
+            "uploads": uploads,
+            "tumor": doc.get("tumor", 0),
+            "tumor_rate": round(doc.get("tumor", 0) / uploads, 4) if uploads else None,
+            "mean_confidence": round(doc["confidence_sum"] / confidence_count, 4) if confidence_count else None,
+            "confidence_histogram": [histogram.get(str(i), 0) for i in range(HISTOGRAM_BINS)],
+        })
+    return series
+
+
+def rebuild(db, batch_size=1000):
+    """
+    Recomputes every rollup from the predictions collection into a staging
+    collection and swaps it in, so readers never see a half-built state.
+    Predictions stored while the rebuild runs may be missing until the next one.
+    """
+    staging = db[f"{ROLLUP_COLLECTION}_rebuild"]
+    staging.drop()
+    cursor = db.predictions.find(
+        {}, {"date": 1, "result": 1, "confidence": 1, "organization": 1, "_id": 0}
+    ).batch_size(batch_size)
+
+    total, written = 0, False
+    batch = []
+    for prediction in cursor:
+        batch.append(prediction)
+        if len(batch) < batch_size:
+            continue
+        operations = rollup_operations(batch)
+        if operations:
+            staging.bulk_write(operations, ordered=False)
+            written = True
+        total += len(batch)
+        batch = []
+    operations = rollup_operations(batch)
+    if operations:
+        staging.bulk_write(operations, ordered=False)
+        written = True
+    total += len(batch)
+
+    if written:
+        staging.rename(ROLLUP_COLLECTION, dropTarget=True)
+    else:
+        db[ROLLUP_COLLECTION].drop()
+    ensure_indexes(db)
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the prediction analytics rollups.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI'))
+    args = parser.parse_args()
+    if not args.mongo_uri:
+        parser.error("Set MONGO_URI or pass --mongo-uri")
+
+    import db
+    db.configure(uri=args.mongo_uri)
+    print(f"✅ Rebuilt rollups from {rebuild(db.database)} predictions.")
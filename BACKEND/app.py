@@ -1,8 +1,7 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from flask_bcrypt import Bcrypt
-from pymongo import MongoClient
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 import os
@@ -10,6 +9,9 @@ from werkzeug.utils import secure_filename
 import logging
 from datetime import datetime, timezone
 
+from db import database
+from auth_cache import user_cache, revocations, register_jwt_callbacks
+
 # -----------------------
 # Basic Logging Setup
 # -----------------------
@@ -34,11 +36,10 @@ MONGO_URI = os.environ.get("MONGO_URI")
 if not MONGO_URI:
     raise ValueError("MONGO_URI environment variable not set")
     
-client = MongoClient(MONGO_URI)
-db = client.get_database() 
-users_collection = db.users
-predictions_collection = db.predictions
-chatbot_collection = db.chatbot_history
+# One pooled client per worker process, created on first use (see db.py)
+users_collection = database.users
+predictions_collection = database.predictions
+chatbot_collection = database.chatbot_history
 
 # -----------------------
 # JWT setup
@@ -46,6 +47,14 @@ chatbot_collection = db.chatbot_history
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "a-super-secret-key-that-is-long")
 app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
 jwt = JWTManager(app)
+# Reject logged-out tokens (checked in memory; see auth_cache.py)
+register_jwt_callbacks(jwt)
+
+# -----------------------
+# Upload limits
+# -----------------------
+# Bodies larger than this are refused with 413 before they are read
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_LENGTH", 11 * 1024 * 1024))
 
 # -----------------------
 # Auth: Register endpoint
@@ -93,6 +102,19 @@ def login():
         logging.error(f"Error in login: {e}")
         return jsonify({"msg": "An internal error occurred"}), 500
 
+# -----------------------
+# Auth: Logout endpoint
+# -----------------------
+@app.route("/api/auth/logout", methods=["POST"])
+@jwt_required()
+def logout():
+    try:
+        revocations.revoke_token(get_jwt())
+        return jsonify({"msg": "Logged out"}), 200
+    except Exception as e:
+        logging.error(f"Error in logout: {e}")
+        return jsonify({"msg": "An internal error occurred"}), 500
+
 # -----------------------
 # Profile: Get User Data endpoint
 # -----------------------
@@ -100,10 +122,10 @@ def login():
 @jwt_required()
 def get_profile_by_email(email):
     try:
-        current_user_id = get_jwt_identity()
-        user = users_collection.find_one({"email": email.lower()})
+        # The caller's own document comes from the per-worker cache
+        user = user_cache.get(get_jwt_identity())
 
-        if not user or str(user["_id"]) != current_user_id:
+        if not user or user.get("email") != email.lower():
              return jsonify({"msg": "User not found or unauthorized"}), 404
 
         user_info = {
@@ -135,6 +157,7 @@ def update_profile():
             {"_id": ObjectId(current_user_id)},
             {"$set": {"name": new_name}}
         )
+        user_cache.invalidate(current_user_id)
         return jsonify({"success": True, "msg": "Profile updated successfully!"}), 200
     except Exception as e:
         logging.error(f"Error updating profile: {e}")
@@ -262,6 +285,24 @@ def get_chat_history():
         logging.error(f"Error fetching chat history: {e}")
         return jsonify({"msg": "An internal error occurred"}), 500
 
+# -----------------------
+# Admin API (model registry, shadow scoring, profiling, pools, caches)
+# -----------------------
+from routes.admin import admin_bp
+app.register_blueprint(admin_bp, url_prefix="/api/admin")
+
+# -----------------------
+# Admin analytics (hourly/daily prediction rollups)
+# -----------------------
+from routes.analytics import analytics_bp
+app.register_blueprint(analytics_bp, url_prefix="/api/analytics")
+
+# -----------------------
+# Streaming exports of prediction and chat history
+# -----------------------
+from routes.export import export_bp
+app.register_blueprint(export_bp, url_prefix="/api/export")
+
 # -----------------------
 # Root endpoint
 # -----------------------
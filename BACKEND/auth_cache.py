@@ -0,0 +1,317 @@
+# BACKEND/auth_cache.py
+"""
+Per-worker caches for authenticated requests.
+
+user_cache
+    TTL cache from a JWT identity to the user document (without the password
+    hash). app.py identifies users by ObjectId string and the blueprints by
+    email; both resolve here. Profile writes invalidate the entry, and other
+    workers pick the change up within USER_CACHE_TTL seconds.
+
+revocations
+    Revoked tokens live in the `revoked_tokens` collection (expiring with the
+    token). Each worker keeps a Bloom filter of every revoked jti, a small
+    exact set of revocations seen since the filter was last rebuilt, and the
+    per-identity "revoked before" markers written on password changes. A
+    background thread loads them at startup and refreshes them every
+    REVOCATION_REFRESH_INTERVAL seconds; only a Bloom filter hit on an
+    unknown jti (or any check before the first load finishes) costs a query.
+    Tokens carry a sub-second "issued_at" claim so a marker revokes exactly
+    the tokens issued before it, including ones from the same second.
+"""
+import datetime
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+from db import database
+
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+REVOCATION_REFRESH_INTERVAL = float(os.getenv('REVOCATION_REFRESH_INTERVAL', 30))
+# The Bloom filter is rebuilt (and resized) from scratch this often
+REVOCATION_REBUILD_INTERVAL = float(os.getenv('REVOCATION_REBUILD_INTERVAL', 600))
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+
+def user_filter(identity):
+    """
+    Mongo filter for a JWT identity: an ObjectId string (app.py) or an email
+    (blueprints). A 24-hex-digit string could be either, so it matches both.
+    """
+    if isinstance(identity, ObjectId):
+        return {"_id": identity}
+    identity = str(identity)
+    if '@' not in identity and ObjectId.is_valid(identity):
+        return {"$or": [{"_id": ObjectId(identity)}, {"email": identity}]}
+    return {"email": identity}
+
+
+class UserCache:
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # identity -> (expires_at, user document)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, identity):
+        """Returns the user document for a token identity, or None if there is no such user."""
+        if not identity:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(identity)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(identity)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = database.users.find_one(user_filter(identity), {"password": 0})
+        if user is not None:
+            with self._lock:
+                self._entries[identity] = (now + self.ttl, user)
+                self._entries.move_to_end(identity)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, *identities):
+        """Drops every cached entry for the given emails / user ids, under either identity form."""
+        keys = {str(identity) for identity in identities if identity}
+        with self._lock:
+            # The same user may be cached under its email and its ObjectId string
+            for key in list(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    keys.update({str(entry[1].get("_id")), str(entry[1].get("email"))})
+            for identity, (_, user) in list(self._entries.items()):
+                if identity in keys or str(user.get("_id")) in keys or user.get("email") in keys:
+                    del self._entries[identity]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, using double hashing of one blake2b digest."""
+
+    def __init__(self, capacity, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1000)
+        self.size = max(64, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(0)
+        self._recent = set()       # jtis revoked since the Bloom filter was built
+        self._not_revoked = OrderedDict()  # Bloom false positives already confirmed against Mongo
+        self._revoked_before = {}  # identity -> unix time; tokens issued earlier are revoked
+        self._last_refresh = None
+        self._loaded = False  # False until this process's first refresh completes
+        self._last_rebuild = 0.0
+        self._thread_pid = None
+        self._indexes_ready = False
+
+    # --- Writing ---
+    def _ensure_indexes(self):
+        if not self._indexes_ready:
+            database.revoked_tokens.create_index([("jti", ASCENDING)], sparse=True)
+            database.revoked_tokens.create_index([("identity", ASCENDING)], sparse=True)
+            # Mongo deletes each entry once the token it refers to has expired anyway
+            database.revoked_tokens.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+            self._indexes_ready = True
+
+    def revoke_token(self, jwt_payload):
+        """Revokes one token (logout)."""
+        self._ensure_indexes()
+        jti = jwt_payload["jti"]
+        entry = {"jti": jti, "subject": jwt_payload.get("sub"), "revoked_at": datetime.datetime.utcnow()}
+        if jwt_payload.get("exp"):
+            entry["expires_at"] = datetime.datetime.utcfromtimestamp(jwt_payload["exp"])
+        database.revoked_tokens.insert_one(entry)
+        with self._lock:
+            self._recent.add(jti)
+            self._not_revoked.pop(jti, None)
+
+    def revoke_all_before(self, identity, token_lifetime):
+        """
+        Revokes every token issued to `identity` up to now (password change).
+        token_lifetime is the app's JWT_ACCESS_TOKEN_EXPIRES; False keeps the marker forever.
+        """
+        self._ensure_indexes()
+        now = datetime.datetime.utcnow()
+        # Tokens issued at or before this instant are revoked (see _issued_before)
+        cutoff = time.time()
+        update = {"$set": {"revoked_before": cutoff, "revoked_at": now}}
+        if token_lifetime:
+            update["$set"]["expires_at"] = now + token_lifetime
+        else:
+            update["$unset"] = {"expires_at": ""}
+        database.revoked_tokens.update_one({"identity": str(identity)}, update, upsert=True)
+        with self._lock:
+            self._revoked_before[str(identity)] = cutoff
+
+    # --- Checking ---
+    def is_revoked(self, jwt_payload):
+        self._ensure_refresher()
+        if not self._loaded:
+            # The first load is still running in the background; ask Mongo directly
+            return self._query_revoked(jwt_payload)
+
+        identity = str(jwt_payload.get("sub"))
+        cutoff = self._revoked_before.get(identity)
+        if cutoff is not None and _issued_before(jwt_payload, cutoff):
+            return True
+
+        jti = jwt_payload.get("jti")
+        if not jti:
+            return False
+        with self._lock:
+            if jti in self._recent:
+                return True
+            if jti not in self._bloom or jti in self._not_revoked:
+                return False
+        # Bloom filter hit on an unknown jti: confirm it (false positives are ~1%)
+        revoked = database.revoked_tokens.find_one({"jti": jti}, {"_id": 1}) is not None
+        with self._lock:
+            if revoked:
+                self._recent.add(jti)
+            else:
+                self._not_revoked[jti] = True
+                while len(self._not_revoked) > 10000:
+                    self._not_revoked.popitem(last=False)
+        return revoked
+
+    def _query_revoked(self, jwt_payload):
+        conditions = [{"identity": str(jwt_payload.get("sub"))}]
+        if jwt_payload.get("jti"):
+            conditions.append({"jti": jwt_payload["jti"]})
+        for entry in database.revoked_tokens.find({"$or": conditions}, {"jti": 1, "revoked_before": 1}):
+            if entry.get("jti") or _issued_before(jwt_payload, entry["revoked_before"]):
+                return True
+        return False
+
+    # --- Refreshing ---
+    def refresh(self):
+        """Pulls revocations from Mongo: everything on a rebuild, otherwise only what's new."""
+        started = datetime.datetime.utcnow()
+        rebuild = self._last_refresh is None or time.monotonic() - self._last_rebuild >= REVOCATION_REBUILD_INTERVAL
+        query = {} if rebuild else {"revoked_at": {"$gte": self._last_refresh}}
+        jtis, markers = [], {}
+        for entry in database.revoked_tokens.find(query, {"jti": 1, "identity": 1, "revoked_before": 1}):
+            if entry.get("jti"):
+                jtis.append(entry["jti"])
+            elif entry.get("identity"):
+                markers[entry["identity"]] = entry["revoked_before"]
+
+        with self._lock:
+            if rebuild:
+                bloom = BloomFilter(len(jtis) * 2)
+                for jti in jtis:
+                    bloom.add(jti)
+                self._bloom, self._recent = bloom, set()
+                self._not_revoked.clear()
+                self._revoked_before = markers
+                self._last_rebuild = time.monotonic()
+            else:
+                self._recent.update(jtis)
+                self._revoked_before.update(markers)
+        # Overlap the next incremental window slightly so nothing falls between refreshes
+        self._last_refresh = started - datetime.timedelta(seconds=5)
+        self._loaded = True
+
+    def _ensure_refresher(self):
+        """Starts this process's refresh thread, which also does the first load."""
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._last_refresh = None
+            self._loaded = False
+        threading.Thread(target=self._refresh_loop, name='token-revocations', daemon=True).start()
+
+    def _refresh_loop(self):
+        pid = os.getpid()
+        delay = 0
+        while self._thread_pid == pid:
+            time.sleep(delay)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ ERROR refreshing token revocations: {e}")
+            delay = REVOCATION_REFRESH_INTERVAL
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bloom_bits": self._bloom.size,
+                "bloom_hashes": self._bloom.hashes,
+                "recent": len(self._recent),
+                "revoked_before_markers": len(self._revoked_before),
+            }
+
+
+def _issued_before(jwt_payload, cutoff):
+    # Tokens from before issued_at existed only have whole-second "iat": revoke the whole cutoff second
+    if "issued_at" in jwt_payload:
+        return jwt_payload["issued_at"] <= cutoff
+    return jwt_payload.get("iat", 0) <= cutoff
+
+
+# Shared per-process instances
+user_cache = UserCache()
+revocations = RevocationList()
+
+
+def _after_fork_in_child():
+    # A lock held by another thread at fork time would never be released in the child
+    user_cache._lock = threading.Lock()
+    revocations._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def register_jwt_callbacks(jwt_manager):
+    """Makes a JWTManager stamp tokens with issued_at and reject revoked ones."""
+    @jwt_manager.additional_claims_loader
+    def add_issued_at(identity):
+        return {"issued_at": time.time()}
+
+    @jwt_manager.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return revocations.is_revoked(jwt_payload)
+
+    # Start loading revocations now rather than on the first request; a forked
+    # worker notices the new pid on first use and starts its own thread.
+    revocations._ensure_refresher()
+    return jwt_manager
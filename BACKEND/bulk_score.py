@@ -0,0 +1,343 @@
+"""
+Offline bulk scoring for folders of scans, without going through the API.
+
+    python bulk_score.py "predicting images" validator_data --output scores.csv
+    python bulk_score.py archive/ --output scores_parquet --format parquet --upsert --user-id clinic@example.com
+
+Images are decoded and preprocessed in a process pool, batched, and scored by
+the active model_loader model. Results are appended to CSV (or written as
+Parquet part files) after every batch, and the processed paths are recorded in
+a manifest, so an interrupted run picks up where it stopped when re-run with
+the same --output.
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Decode workers only need the transform; the model is loaded once, in the parent.
+os.environ.setdefault('MODEL_PRELOAD', '0')
+
+import torch
+from PIL import Image
+
+import analytics
+import db
+import model_loader
+from auth_cache import user_filter
+from embedding_index import index as embedding_index
+from upload_guard import MAX_IMAGE_PIXELS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+FIELDS = ['path', 'filename', 'image_hash', 'result', 'probability', 'confidence', 'model_version', 'scored_at']
+
+_transform = None
+
+
+def find_images(paths):
+    for root in paths:
+        if os.path.isfile(root):
+            yield os.path.abspath(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.abspath(os.path.join(dirpath, name))
+
+
+def decode_image(path):
+    """Runs in a pool process: returns (path, sha256, tensor) or (path, None, error message)."""
+    global _transform
+    if _transform is None:
+        _transform = model_loader.get_image_transform()
+    try:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            return path, None, f"image too large ({image.width}x{image.height})"
+        return path, hashlib.sha256(image_bytes).hexdigest(), _transform(image.convert('L'))
+    except Exception as e:
+        return path, None, str(e)
+
+
+def produce_batches(paths, pool, batch_size, batches, errors):
+    """
+    Keeps a bounded window of decode jobs in flight and queues full batches in
+    order. Always ends with a None sentinel; if decoding breaks down (e.g. a
+    BrokenProcessPool) the exception is queued just before it.
+    """
+    try:
+        window = deque()
+        pending = iter(paths)
+        batch = []
+        max_in_flight = batch_size * (batches.maxsize + 1)
+        exhausted = False
+        while window or not exhausted:
+            while not exhausted and len(window) < max_in_flight:
+                path = next(pending, None)
+                if path is None:
+                    exhausted = True
+                else:
+                    window.append(pool.submit(decode_image, path))
+            if not window:
+                break
+            path, digest, payload = window.popleft().result()
+            if digest is None:
+                errors.append((path, payload))
+                continue
+            batch.append((path, digest, payload))
+            if len(batch) == batch_size:
+                batches.put(batch)
+                batch = []
+        if batch:
+            batches.put(batch)
+    except Exception as e:
+        batches.put(e)
+    finally:
+        batches.put(None)
+
+
+class CsvSink:
+    def __init__(self, path):
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        if is_new:
+            self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """Writes one part file per run into the output folder, one row group per batch."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        self.pa = pa
+        os.makedirs(path, exist_ok=True)
+        part = os.path.join(path, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.parquet")
+        self.schema = pa.schema([
+            ('path', pa.string()), ('filename', pa.string()), ('image_hash', pa.string()),
+            ('result', pa.string()), ('probability', pa.float64()), ('confidence', pa.string()),
+            ('model_version', pa.string()), ('scored_at', pa.string()),
+        ])
+        self.writer = pq.ParquetWriter(part, self.schema)
+
+    def write(self, rows):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class Manifest:
+    """
+    Append-only list of paths already handled, used to resume a run. Images
+    that could not be decoded are recorded as "!<path>\t<error>" so a resumed
+    run skips them too (unless --retry-failed).
+    """
+
+    def __init__(self, path, retry_failed=False):
+        self.path = path
+        self.done = set()
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line.startswith('!'):
+                        failed_path, _, message = line[1:].rpartition('\t')
+                        self.failed[failed_path] = message
+                    elif line:
+                        self.done.add(line)
+        if retry_failed:
+            self.failed = {}
+        self.file = open(path, 'a')
+
+    def skip(self, path):
+        return path in self.done or path in self.failed
+
+    def record(self, paths):
+        self.file.write(''.join(f"{p}\n" for p in paths))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def record_failures(self, failures):
+        if not failures:
+            return
+        self.record(f"!{path}\t{' '.join(str(message).split())}" for path, message in failures)
+        self.failed.update(failures)
+
+    def close(self):
+        self.file.close()
+
+
+def upsert_predictions(collection, rows, user_id, embeddings=None, organization=None):
+    from pymongo import UpdateOne
+    now = datetime.datetime.now()
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "source_path": row["path"]},
+            {"$set": {
+                "user_id": user_id,
+                "filename": row["filename"],
+                "result": row["result"],
+                "confidence": row["confidence"],
+                "image_hash": row["image_hash"],
+                "model_version": row["model_version"],
+                "source_path": row["path"],
+                "date": now,
+                **({"organization": organization} if organization else {}),
+            }},
+            upsert=True,
+        )
+        for row in rows
+    ]
+    result = collection.bulk_write(operations, ordered=False)
+    # Re-scored paths only update their record; count just the new ones in the rollups
+    analytics.record_predictions(db.database, [
+        {"date": now, "result": rows[i]["result"], "confidence": rows[i]["confidence"], "organization": organization}
+        for i in result.upserted_ids
+    ])
+
+    if embeddings is not None:
+        # Index every upserted record like an upload, so "similar cases" covers bulk
+        # results too; re-scored records get their new embedding (the latest row wins).
+        ids = {doc["source_path"]: str(doc["_id"]) for doc in collection.find(
+            {"user_id": user_id, "source_path": {"$in": [row["path"] for row in rows]}},
+            {"source_path": 1},
+        )}
+        for row, embedding in zip(rows, embeddings):
+            if row["path"] in ids:
+                embedding_index.add(embedding, ids[row["path"]], user_id, organization)
+
+
+def _record_failures(manifest, errors, recorded):
+    # errors is appended to by the producer thread; checkpoint whatever is new
+    new = errors[recorded:]
+    manifest.record_failures(new)
+    return recorded + len(new)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help="Image files or folders to score (searched recursively)")
+    parser.add_argument('--output', required=True, help="CSV file, or folder of Parquet part files")
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="Defaults to the --output extension")
+    parser.add_argument('--manifest', help="Checkpoint manifest (default: <output>.manifest)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decode processes")
+    parser.add_argument('--prefetch', type=int, default=4, help="Decoded batches buffered ahead of the model")
+    parser.add_argument('--upsert', action='store_true', help="Also bulk-upsert results into the predictions collection")
+    parser.add_argument('--user-id', help="user_id to store upserted predictions under")
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI'))
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Retry images an earlier run could not decode (skipped by default)")
+    args = parser.parse_args()
+
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'parquet')
+    manifest = Manifest(args.manifest or f"{args.output.rstrip(os.sep)}.manifest", args.retry_failed)
+
+    collection, organization = None, None
+    if args.upsert:
+        if not args.mongo_uri or not args.user_id:
+            parser.error("--upsert needs --user-id and MONGO_URI (or --mongo-uri)")
+        db.configure(uri=args.mongo_uri)
+        collection = db.database.predictions
+        organization = (db.database.users.find_one(user_filter(args.user_id), {"organization": 1}) or {}).get("organization")
+
+    paths = [p for p in find_images(args.paths) if not manifest.skip(p)]
+    print(f"Found {len(paths)} images to score ({len(manifest.done)} already done, "
+          f"{len(manifest.failed)} skipped as undecodable).")
+    if not paths:
+        return
+
+    loaded = model_loader.registry.active()
+    print(f"Scoring with model version '{loaded.version}' ({loaded.weights_hash})")
+    sink = CsvSink(args.output) if output_format == 'csv' else ParquetSink(args.output)
+
+    batches = queue.Queue(maxsize=args.prefetch)
+    errors = []
+    recorded_errors = 0
+    scored = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        producer = threading.Thread(
+            target=produce_batches, args=(paths, pool, args.batch_size, batches, errors), daemon=True
+        )
+        producer.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                images = torch.stack([tensor for _, _, tensor in batch])
+                embeddings = None
+                if collection is not None:
+                    probabilities, embeddings = model_loader.forward_with_embedding(
+                        loaded.model, images.to(model_loader.device)
+                    )
+                    probabilities, embeddings = probabilities.tolist(), embeddings.cpu().numpy()
+                else:
+                    probabilities = model_loader.predict_batch(loaded.model, images)
+                scored_at = datetime.datetime.now().isoformat(timespec='seconds')
+                rows = [{
+                    "path": path,
+                    "filename": os.path.basename(path),
+                    "image_hash": digest,
+                    "result": "Tumor Detected" if probability > 0.5 else "No Tumor",
+                    "probability": probability,
+                    "confidence": f"{probability * 100:.2f}%",
+                    "model_version": loaded.version,
+                    "scored_at": scored_at,
+                } for (path, digest, _), probability in zip(batch, probabilities)]
+
+                # Write results before checkpointing so a crash can only repeat work, never lose it.
+                sink.write(rows)
+                if collection is not None:
+                    upsert_predictions(collection, rows, args.user_id, embeddings, organization)
+                manifest.record(row["path"] for row in rows)
+                recorded_errors = _record_failures(manifest, errors, recorded_errors)
+
+                scored += len(rows)
+                elapsed = time.perf_counter() - started
+                print(f"\r{scored}/{len(paths)} scored  {scored / elapsed:.1f} images/s", end='', flush=True)
+        except KeyboardInterrupt:
+            print("\nInterrupted; re-run the same command to resume.")
+            pool.shutdown(wait=False, cancel_futures=True)
+        finally:
+            sink.close()
+            _record_failures(manifest, errors, recorded_errors)
+            manifest.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\nScored {scored} images in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} images/s).")
+    if errors:
+        print(f"{len(errors)} images could not be decoded:", file=sys.stderr)
+        for path, message in errors[:20]:
+            print(f"  {path}: {message}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
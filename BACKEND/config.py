@@ -17,4 +17,8 @@ class Config:
     # JWT Secret Key
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'another-super-secret-jwt-key'
 
+    # Largest request body Flask will accept (413 otherwise); leaves headroom
+    # over MAX_UPLOAD_BYTES for the multipart envelope
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 11 * 1024 * 1024)
+
 
@@ -0,0 +1,258 @@
+# BACKEND/db.py
+"""
+Shared MongoDB access for the whole backend.
+
+Every process gets exactly one MongoClient, created lazily on first use, and
+re-created in a forked child (gunicorn workers, DataLoader/pool processes)
+instead of inheriting the parent's sockets. Pool size and timeouts come from
+the environment, and a pool listener keeps connection and checkout-latency
+metrics for the admin API.
+
+Use the `database` proxy anywhere a pymongo Database would go:
+
+    from db import database
+    database.users.find_one({"email": email})
+
+Collections obtained from it (even at import time) resolve the current
+process's client on every call, so they stay valid across forks.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.monitoring import ConnectionPoolListener
+
+# Load environment variables from a .env file (this module may be imported before config.py)
+load_dotenv()
+
+# --- Connection settings ---
+MONGO_URI = os.getenv('MONGO_URI')
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')  # defaults to the database named in the URI
+CLIENT_OPTIONS = {
+    # Per worker process; total connections ~= workers x maxPoolSize per mongod
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 10)),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 20000)),
+    # How long a request may wait for a free pooled connection before failing
+    'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+}
+CHECKOUT_SAMPLES = 1000
+
+
+class PoolMetrics(ConnectionPoolListener):
+    """Counts pool events and samples how long checkouts wait for a connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {
+                "connections_created": 0,
+                "connections_closed": 0,
+                "checkouts": 0,
+                "checkout_failures": 0,
+                "pool_clears": 0,
+            }
+            self.open_connections = 0
+            self.checked_out = 0
+            self.max_checked_out = 0
+            self.checkout_waits = deque(maxlen=CHECKOUT_SAMPLES)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count("pool_clears")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.counters["connections_created"] += 1
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.counters["connections_closed"] += 1
+            self.open_connections -= 1
+
+    # Checkout events fire synchronously on the requesting thread.
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._count("checkout_failures")
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        with self._lock:
+            self.counters["checkouts"] += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            if started is not None:
+                self.checkout_waits.append(time.perf_counter() - started)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self.checkout_waits)
+            stats = dict(self.counters)
+            stats.update({
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+            })
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 3) if waits else None
+        stats["checkout_wait_ms"] = {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)}
+        return stats
+
+
+metrics = PoolMetrics()
+
+_lock = threading.Lock()
+_client = None
+_database = None
+_client_pid = None
+_client_factory = None
+_factory_database_name = None
+
+
+def _create_client():
+    if _client_factory is not None:
+        return _client_factory()
+    if not MONGO_URI:
+        raise RuntimeError("MONGO_URI environment variable not set")
+    return MongoClient(MONGO_URI, event_listeners=[metrics], **CLIENT_OPTIONS)
+
+
+def get_client():
+    """Returns this process's MongoClient, creating it on first use (and again after a fork)."""
+    global _client, _database, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _create_client()
+            name = _factory_database_name or MONGO_DB_NAME
+            _database = _client[name] if name else _client.get_database()
+            _client_pid = os.getpid()
+            print(f"✅ MongoDB client created (pid {_client_pid}, maxPoolSize {CLIENT_OPTIONS['maxPoolSize']})")
+        return _client
+
+
+def get_db():
+    get_client()
+    return _database
+
+
+def configure(uri=None, database_name=None, client_factory=None, **options):
+    """
+    Overrides the connection settings before the first query (CLI tools,
+    load tests). client_factory, if given, builds the client instead of
+    MongoClient, e.g. a mongomock client.
+    """
+    global MONGO_URI, MONGO_DB_NAME, _client_factory, _factory_database_name
+    if uri:
+        MONGO_URI = uri
+    if database_name:
+        MONGO_DB_NAME = database_name
+    CLIENT_OPTIONS.update(options)
+    _client_factory = client_factory
+    _factory_database_name = database_name if client_factory else None
+    reset()
+
+
+def reset():
+    """Drops this process's client so the next use creates a fresh one."""
+    global _client, _database, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client, _database, _client_pid = None, None, None
+        metrics.reset()
+
+
+def _after_fork_in_child():
+    # The parent's sockets and monitor threads don't survive a fork; never
+    # close them from the child, just forget them and start over.
+    global _client, _database, _client_pid, _lock
+    _lock = threading.Lock()
+    metrics._lock = threading.Lock()
+    _client, _database, _client_pid = None, None, None
+    metrics.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def pool_stats():
+    """This worker's pool settings and metrics."""
+    return {
+        "pid": os.getpid(),
+        "connected": _client is not None and _client_pid == os.getpid(),
+        "options": dict(CLIENT_OPTIONS),
+        **metrics.snapshot(),
+    }
+
+
+# --- Fork-safe proxies ---
+class _LazyCollection:
+    """Resolves the named collection on the current process's client at every use."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self._name], attr)
+
+    def __getitem__(self, key):
+        return get_db()[self._name][key]
+
+    def __repr__(self):
+        return f"<collection {self._name!r} (lazy)>"
+
+
+class _LazyDatabase:
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if hasattr(Database, name):  # command(), list_collection_names(), client, ...
+            return getattr(get_db(), name)
+        return _LazyCollection(name)
+
+    def __getitem__(self, name):
+        return _LazyCollection(name)
+
+    def __repr__(self):
+        return "<database (lazy)>"
+
+
+database = _LazyDatabase()
@@ -0,0 +1,317 @@
+# BACKEND/embedding_index.py
+"""
+Nearest-neighbour index over the 1024-d DenseNet121 features of past scans.
+
+Everything is stored in append-only files under INDEX_DIR so that every
+gunicorn worker shares one index and a restart only memory-maps it:
+
+    vectors.f16   L2-normalized embeddings, float16, one row per prediction
+    rows.bin      per-row record: prediction ObjectId, owner codes (ROW_DTYPE)
+    owners.jsonl  user / organization strings; a row stores the line number
+    ivf.npy       optional IVF centroids  (python embedding_index.py build-ivf)
+    ivf.i32       IVF list of every row, written as rows are added
+
+Writers take an exclusive flock on a lock file; readers notice growth with a
+single stat() and re-map. Each process keeps in memory what it has read so
+far (prediction id -> row, owner codes, the rows of every IVF list) and only
+reads what other workers appended since. Re-indexing a prediction appends a
+new row; the older rows for that id are marked stale and never returned.
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+from bson.objectid import ObjectId
+
+INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', 'embedding_index')
+EMBEDDING_DIM = 1024
+ROW_DTYPE = np.dtype([('prediction_id', 'S12'), ('user', '<i4'), ('organization', '<i4')])
+VECTOR_BYTES = EMBEDDING_DIM * 2
+NO_OWNER = -1
+
+# Rows are scored in chunks so a large index never needs a full float32 copy.
+SEARCH_CHUNK = 16384
+# IVF is only used once the index is big enough for brute force to hurt.
+IVF_MIN_ROWS = int(os.getenv('EMBEDDING_IVF_MIN_ROWS', 50000))
+IVF_NPROBE = int(os.getenv('EMBEDDING_IVF_NPROBE', 8))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _write_at(path, offset, data):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _group_rows(ivf_lists, nlist):
+    """Splits row numbers by IVF list: element i holds the (ascending) rows in list i."""
+    order = np.argsort(ivf_lists, kind='stable')
+    bounds = np.searchsorted(np.asarray(ivf_lists)[order], np.arange(nlist + 1))
+    return [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+
+
+class EmbeddingIndex:
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = directory
+        self.paths = {name: os.path.join(directory, name) for name in (
+            'vectors.f16', 'rows.bin', 'owners.jsonl', 'ivf.npy', 'ivf.i32', 'lock',
+        )}
+        self._lock = threading.Lock()
+        self._rows_size = -1
+        self._ivf_mtime = None
+        self.vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float16)
+        self.rows = np.zeros(0, dtype=ROW_DTYPE)
+        self.owner_codes = {}
+        self._owners_offset = 0
+        self.row_of = {}  # prediction id bytes (trailing NULs stripped, as numpy reads them) -> latest row
+        self.stale = np.zeros(0, dtype=bool)  # True for rows superseded by a later row for the same id
+        self.centroids = None
+        self.ivf_lists = None
+        self.list_rows = None  # IVF list number -> int64 array of its rows, ascending
+        self.refresh()
+
+    # --- Loading ---
+    def refresh(self):
+        """Re-maps the files if another worker (or this one) has appended rows."""
+        rows_size = _file_size(self.paths['rows.bin'])
+        ivf_mtime = os.path.getmtime(self.paths['ivf.npy']) if os.path.exists(self.paths['ivf.npy']) else None
+        if rows_size == self._rows_size and ivf_mtime == self._ivf_mtime:
+            return
+        with self._lock:
+            previous = len(self.rows)
+            count = min(rows_size // ROW_DTYPE.itemsize, _file_size(self.paths['vectors.f16']) // VECTOR_BYTES)
+            if count:
+                self.vectors = np.memmap(self.paths['vectors.f16'], dtype=np.float16, mode='r',
+                                         shape=(count, EMBEDDING_DIM))
+                self.rows = np.memmap(self.paths['rows.bin'], dtype=ROW_DTYPE, mode='r', shape=(count,))
+            if count < previous:
+                # The index was replaced; start over
+                previous, self.row_of = 0, {}
+            stale = np.zeros(count, dtype=bool)
+            stale[:previous] = self.stale[:previous]
+            for row, prediction_id in enumerate(self.rows['prediction_id'][previous:count].tolist(), previous):
+                superseded = self.row_of.get(prediction_id)
+                if superseded is not None:
+                    stale[superseded] = True
+                self.row_of[prediction_id] = row
+            self.stale = stale
+            self._load_owners()
+
+            if ivf_mtime is not None and count and _file_size(self.paths['ivf.i32']) >= count * 4:
+                ivf_lists = np.memmap(self.paths['ivf.i32'], dtype='<i4', mode='r', shape=(count,))
+                if ivf_mtime != self._ivf_mtime or self.list_rows is None or count < previous:
+                    # New centroids: regroup every row
+                    self.centroids = np.load(self.paths['ivf.npy'])
+                    self.list_rows = _group_rows(ivf_lists, len(self.centroids))
+                elif count > previous:
+                    # Only the appended rows need placing; untouched lists are kept as they are
+                    for ivf_list, rows in enumerate(_group_rows(ivf_lists[previous:count], len(self.centroids))):
+                        if len(rows):
+                            self.list_rows[ivf_list] = np.concatenate([self.list_rows[ivf_list], rows + previous])
+                self.ivf_lists = ivf_lists
+            else:
+                self.centroids, self.ivf_lists, self.list_rows = None, None, None
+            self._rows_size = rows_size
+            self._ivf_mtime = ivf_mtime
+
+    def _load_owners(self):
+        """Reads the owner lines other workers appended since the last call."""
+        path = self.paths['owners.jsonl']
+        if _file_size(path) < self._owners_offset:
+            self.owner_codes, self._owners_offset = {}, 0
+        if _file_size(path) == self._owners_offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self._owners_offset)
+            data = f.read()
+        # Only whole lines; a writer may be halfway through one
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.decode('utf-8').splitlines():
+            self.owner_codes[line] = len(self.owner_codes)
+        self._owners_offset += len(data)
+
+    def __len__(self):
+        self.refresh()
+        return len(self.rows)
+
+    # --- Writing ---
+    def add(self, embedding, prediction_id, user_id, organization=None):
+        """Appends one prediction's embedding; safe across threads and processes."""
+        vector = _normalize(embedding).astype(np.float16).reshape(EMBEDDING_DIM)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.paths['lock'], 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Codes other workers added since we last looked
+                self._load_owners()
+                user_code = self._owner_code(('user', str(user_id)))
+                org_code = self._owner_code(('organization', str(organization))) if organization else NO_OWNER
+                row = _file_size(self.paths['rows.bin']) // ROW_DTYPE.itemsize
+
+                # The vector (and IVF list) go in first, at the row's offset, and the
+                # record last; a crash can at worst leave data the next add overwrites.
+                _write_at(self.paths['vectors.f16'], row * VECTOR_BYTES, vector.tobytes())
+                if os.path.exists(self.paths['ivf.npy']):
+                    centroids = self._current_centroids()
+                    ivf_list = np.int32(np.argmax(centroids @ vector.astype(np.float32)))
+                    _write_at(self.paths['ivf.i32'], row * 4, ivf_list.astype('<i4').tobytes())
+                record = np.array([(ObjectId(prediction_id).binary, user_code, org_code)], dtype=ROW_DTYPE)
+                with open(self.paths['rows.bin'], 'ab') as f:
+                    f.write(record.tobytes())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _owner_code(self, key):
+        # Called with the write lock held, after _load_owners(), so codes line up with the file
+        key_str = json.dumps(list(key))
+        code = self.owner_codes.get(key_str)
+        if code is None:
+            code = len(self.owner_codes)
+            line = (key_str + '\n').encode('utf-8')
+            with open(self.paths['owners.jsonl'], 'ab') as f:
+                f.write(line)
+            self.owner_codes[key_str] = code
+            self._owners_offset += len(line)
+        return code
+
+    def _current_centroids(self):
+        mtime = os.path.getmtime(self.paths['ivf.npy'])
+        if self.centroids is None or mtime != self._ivf_mtime:
+            return np.load(self.paths['ivf.npy'])
+        return self.centroids
+
+    def _code_for(self, kind, value):
+        return self.owner_codes.get(json.dumps([kind, str(value)]))
+
+    # --- Searching ---
+    def get_vector(self, prediction_id):
+        """Returns the stored embedding for a prediction, or None if it isn't indexed."""
+        self.refresh()
+        row = self.row_of.get(ObjectId(prediction_id).binary.rstrip(b'\0'))
+        if row is None:
+            return None
+        return np.asarray(self.vectors[row], dtype=np.float32)
+
+    def search(self, query, k=5, user_id=None, organization=None, exclude_prediction_id=None):
+        """
+        Returns up to k (prediction_id, cosine similarity) pairs, most similar
+        first, restricted to one user's or one organization's scans.
+        """
+        self.refresh()
+        with self._lock:
+            rows, vectors, centroids, list_rows, stale = self.rows, self.vectors, self.centroids, self.list_rows, self.stale
+        if not len(rows):
+            return []
+
+        user_code = organization_code = None
+        if user_id is not None:
+            user_code = self._code_for('user', user_id)
+            if user_code is None:
+                return []
+        if organization is not None:
+            organization_code = self._code_for('organization', organization)
+            if organization_code is None:
+                return []
+
+        query = _normalize(query).reshape(EMBEDDING_DIM)
+        if list_rows is not None and len(rows) >= IVF_MIN_ROWS:
+            # Only the lists whose centroids are closest to the query are read at all.
+            probes = np.argsort(-(centroids @ query))[:IVF_NPROBE]
+            candidates = np.sort(np.concatenate([list_rows[probe] for probe in probes]))
+            owners = rows[candidates]
+        else:
+            candidates, owners = np.arange(len(rows)), rows
+
+        # Only each prediction's latest row counts; re-scored predictions appear once
+        mask = ~stale[candidates]
+        if user_code is not None:
+            mask &= owners['user'] == user_code
+        if organization_code is not None:
+            mask &= owners['organization'] == organization_code
+        if exclude_prediction_id is not None:
+            mask &= owners['prediction_id'] != ObjectId(exclude_prediction_id).binary.rstrip(b'\0')
+        candidates = candidates[mask]
+        if not len(candidates):
+            return []
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), SEARCH_CHUNK):
+            chunk = candidates[start:start + SEARCH_CHUNK]
+            scores[start:start + len(chunk)] = np.asarray(vectors[chunk], dtype=np.float32) @ query
+
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        # numpy drops trailing NUL bytes from 'S' fields, so pad the ids back to 12 bytes
+        return [(str(ObjectId(bytes(rows['prediction_id'][candidates[i]]).ljust(12, b'\0'))), float(scores[i]))
+                for i in top]
+
+    # --- IVF ---
+    def build_ivf(self, nlist=None, iterations=20, sample_size=100000, seed=0):
+        """Trains k-means centroids over the index and assigns every row to a list."""
+        self.refresh()
+        count = len(self.rows)
+        if count == 0:
+            raise ValueError("The index is empty")
+        nlist = nlist or max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(self.vectors[np.sort(rng.choice(count, min(count, sample_size), replace=False))],
+                            dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), nlist, replace=len(sample) < nlist)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        with self._lock, open(self.paths['lock'], 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                count = _file_size(self.paths['rows.bin']) // ROW_DTYPE.itemsize
+                vectors = np.memmap(self.paths['vectors.f16'], dtype=np.float16, mode='r', shape=(count, EMBEDDING_DIM))
+                lists = np.concatenate([
+                    np.argmax(np.asarray(vectors[start:start + SEARCH_CHUNK], dtype=np.float32) @ centroids.T, axis=1)
+                    for start in range(0, count, SEARCH_CHUNK)
+                ]).astype('<i4')
+                lists.tofile(self.paths['ivf.i32'])
+                np.save(self.paths['ivf.npy'], centroids.astype(np.float32))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.refresh()
+        return nlist
+
+
+# Shared per-process instance used by the routes
+index = EmbeddingIndex()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the scan embedding index.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build-ivf', help="Train IVF centroids so large indexes search a subset of lists")
+    build.add_argument('--nlist', type=int, help="Number of lists (default: sqrt of the row count)")
+    sub.add_parser('stats', help="Print the index size")
+    args = parser.parse_args()
+
+    if args.command == 'build-ivf':
+        print(f"Built {index.build_ivf(args.nlist)} IVF lists over {len(index)} rows.")
+    else:
+        print(f"{len(index)} rows, IVF {'on' if index.ivf_lists is not None else 'off'}")
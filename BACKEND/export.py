@@ -0,0 +1,95 @@
+# BACKEND/export.py
+"""
+Streaming serializers for record exports.
+
+Rows are pulled from a Mongo cursor one batch at a time and written out in
+~64 KB chunks, so memory stays flat however many records a user has. With
+compress=True the chunks go through a single gzip stream on the fly.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from bson.objectid import ObjectId
+
+CHUNK_SIZE = 64 * 1024
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def export_row(doc, fields):
+    """Flattens a Mongo document to the export fields; `_id` is exported as `id`."""
+    return {field: _plain(doc.get("_id" if field == "id" else field)) for field in fields}
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    # Filenames and chat text are user-controlled; quote them so they open as text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_chunks(cursor, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for doc in cursor:
+        row = export_row(doc, fields)
+        writer.writerow([_csv_cell(row[field]) for field in fields])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(cursor, fields):
+    lines, size = [], 0
+    for doc in cursor:
+        line = json.dumps(export_row(doc, fields), ensure_ascii=False) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(lines).encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines).encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses a byte-chunk stream into one gzip member without buffering it."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+SERIALIZERS = {
+    "csv": (csv_chunks, "text/csv"),
+    "ndjson": (ndjson_chunks, "application/x-ndjson"),
+}
+
+
+def stream_export(cursor, fields, export_format, compress=False):
+    """Returns (chunk generator, mimetype, file extension) for a cursor."""
+    serializer, mimetype = SERIALIZERS[export_format]
+    chunks = serializer(cursor, fields)
+    if compress:
+        return gzip_chunks(chunks), "application/gzip", f"{export_format}.gz"
+    return chunks, mimetype, export_format
@@ -1,9 +1,13 @@
-from flask_pymongo import PyMongo
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 
+from auth_cache import register_jwt_callbacks
+
 # Initialize Flask extensions here
-mongo = PyMongo()
+# (MongoDB access lives in db.py, shared by every route and tool)
 bcrypt = Bcrypt()
 jwt = JWTManager()
 
+# Reject logged-out tokens and tokens issued before a password change
+register_jwt_callbacks(jwt)
+
@@ -0,0 +1,109 @@
+# BACKEND/gradcam.py
+import hashlib
+import io
+import os
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+import model_loader
+
+# Rendered overlays are cached on disk so every gunicorn worker can reuse them.
+CACHE_DIR = os.getenv('GRADCAM_CACHE_DIR', 'explanations')
+OVERLAY_SIZE = 224
+HEATMAP_ALPHA = 0.45
+TARGET_BLOCK = 'denseblock4'
+
+
+def image_hash(image_bytes):
+    """Returns the SHA-256 hex digest used to key cached explanations."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _cache_path(digest, model_version):
+    return os.path.join(CACHE_DIR, model_version, f"{digest}.png")
+
+
+def get_cached_explanation(digest, model_version=None):
+    """Returns the cached PNG overlay for an image hash, or None on a miss."""
+    path = _cache_path(digest, model_version or model_loader.registry.active().weights_hash)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _store_explanation(digest, model_version, png_bytes):
+    path = _cache_path(digest, model_version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so concurrent readers never see a partial PNG.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(png_bytes)
+    os.replace(tmp_path, path)
+
+
+def compute_heatmap(model, image_tensor):
+    """
+    Runs one forward/backward pass and returns a Grad-CAM map in [0, 1]
+    for the last dense block, shaped like the block's spatial grid.
+    """
+    x = image_tensor
+    activations = None
+    # Walk the feature extractor by hand instead of registering hooks, so
+    # concurrent predictions on the shared model are left untouched.
+    with torch.enable_grad():
+        for name, module in model.features.named_children():
+            x = module(x)
+            if name == TARGET_BLOCK:
+                activations = x
+        pooled = F.adaptive_avg_pool2d(F.relu(x), (1, 1)).flatten(1)
+        logit = model.classifier[0](pooled)[0, 0]
+        # Explain whichever class the model actually predicted.
+        target = logit if logit.item() > 0 else -logit
+        grads, = torch.autograd.grad(target, activations)
+
+    weights = grads.mean(dim=(2, 3), keepdim=True)
+    cam = F.relu((weights * activations).sum(dim=1))[0].detach()
+    cam -= cam.min()
+    if cam.max() > 0:
+        cam /= cam.max()
+    return cam.cpu().numpy()
+
+
+def render_overlay(image, cam):
+    """Blends a Grad-CAM map over the grayscale scan and returns PNG bytes."""
+    base = np.array(image.resize((OVERLAY_SIZE, OVERLAY_SIZE)), dtype=np.uint8)
+    base = cv2.cvtColor(base, cv2.COLOR_GRAY2BGR)
+    cam = cv2.resize(cam, (OVERLAY_SIZE, OVERLAY_SIZE), interpolation=cv2.INTER_LINEAR)
+    heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
+    overlay = cv2.addWeighted(heatmap, HEATMAP_ALPHA, base, 1 - HEATMAP_ALPHA, 0)
+    ok, encoded = cv2.imencode('.png', overlay)
+    if not ok:
+        raise ValueError("Could not encode Grad-CAM overlay")
+    return encoded.tobytes()
+
+
+def get_explanation(image_bytes, digest=None):
+    """
+    Returns the Grad-CAM overlay PNG for an uploaded scan, computing and
+    caching it on the first request for this image and model version.
+    """
+    digest = digest or image_hash(image_bytes)
+    loaded = model_loader.registry.active()
+    model_version = loaded.weights_hash
+    cached = get_cached_explanation(digest, model_version)
+    if cached is not None:
+        return cached
+
+    image = Image.open(io.BytesIO(image_bytes)).convert('L')
+    image_tensor = model_loader.get_image_transform()(image).unsqueeze(0).to(model_loader.device)
+    # Grad-CAM hooks into the DenseNet's layers, which a frozen artifact doesn't expose
+    cam = compute_heatmap(loaded.eager(), image_tensor)
+    png_bytes = render_overlay(image, cam)
+    _store_explanation(digest, model_version, png_bytes)
+    return png_bytes
@@ -7,5 +7,7 @@ bind = "0.0.0.0:10000"  # Render provides the port via the PORT env var, but thi
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "gthread"
-threads = 2
+# Inference is capped per worker by admission.py (ADMISSION_MAX_IN_FLIGHT plus a
+# short queue), so the remaining threads stay free for auth and dashboard traffic
+threads = 8
 timeout = 120
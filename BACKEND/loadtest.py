@@ -0,0 +1,410 @@
+"""
+End-to-end HTTP load test for the Flask backend, without Atlas or Gemini.
+
+The app is started in a separate process against local stand-ins:
+  * Mongo   -> mongomock (pip install mongomock), or a real local mongod via --mongo-uri
+  * Gemini  -> a fake chat model that sleeps for --gemini-latency-ms
+  * DenseNet -> the real architecture with seeded random weights
+
+    python loadtest.py --concurrency 16 --duration 30
+    python loadtest.py --server gunicorn --duration 60              # real gunicorn_config.py
+    python loadtest.py --server gunicorn --workers 3 --threads 8    # try other tunings
+
+With several gunicorn workers and mongomock, each worker has its own
+in-memory database. The scenario only relies on pre-seeded users and on
+JWT identities, so it still works, but point --mongo-uri at a local mongod
+to measure realistic database contention.
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_IMAGES_DIR = os.path.join(BACKEND_DIR, 'validator_data', 'train', 'mri')
+
+SEEDED_PASSWORD = 'loadtest-password'
+SEEDED_EMAIL = 'loadtest-user-{}@example.com'
+
+# Relative weights of each request type in the scenario mix
+SCENARIO = {
+    'login': 10,
+    'register': 5,
+    'upload': 30,
+    'stats': 25,
+    'chat_ask': 15,
+    'chat_history': 15,
+}
+
+
+# ==========================================================
+# Stand-in app (runs inside the server process)
+# ==========================================================
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiChat:
+    """Mimics genai ChatSession.send_message with a configurable delay."""
+
+    def __init__(self, latency_ms, jitter_ms):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+
+    def send_message(self, question):
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+        return FakeGeminiResponse(f"Stand-in answer to: {question[:80]}")
+
+
+def _connect_mongo():
+    import db
+    uri = os.getenv('LOADTEST_MONGO_URI')
+    if uri:
+        db.configure(uri=uri)
+        return db.database
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("mongomock is required for the in-memory database: pip install mongomock "
+                         "(or pass --mongo-uri mongodb://localhost/loadtest)")
+    db.configure(database_name='loadtest', client_factory=mongomock.MongoClient)
+    return db.database
+
+
+def _seed_users(db, count):
+    from werkzeug.security import generate_password_hash
+    # One hash shared by every seeded user keeps worker startup fast.
+    hashed_password = generate_password_hash(SEEDED_PASSWORD, method='pbkdf2:sha256')
+    for i in range(count):
+        email = SEEDED_EMAIL.format(i)
+        db.users.update_one(
+            {'email': email},
+            {'$setOnInsert': {'name': f'Load Test {i}', 'email': email, 'password': hashed_password}},
+            upsert=True,
+        )
+
+
+def create_standin_app():
+    """Builds the API (auth, predict, chatbot, profile, admin, analytics, export blueprints) wired to local stand-ins."""
+    # The harness writes random weights and points the registry at a scratch folder.
+    os.environ.setdefault('MODEL_DIR', os.path.join(os.getcwd(), 'model_versions'))
+
+    from flask import Flask
+    from flask_cors import CORS
+    from config import Config
+    from extensions import bcrypt, jwt
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    CORS(app, supports_credentials=True)
+    bcrypt.init_app(app)
+    jwt.init_app(app)
+    database = _connect_mongo()
+    _seed_users(database, int(os.getenv('LOADTEST_USERS', '20')))
+
+    import routes.chatbot
+    from routes.admin import admin_bp
+    from routes.analytics import analytics_bp
+    from routes.auth import auth_bp
+    from routes.export import export_bp
+    from routes.predict import predict_bp
+    from routes.profile import profile_bp
+    routes.chatbot.chat = FakeGeminiChat(
+        float(os.getenv('LOADTEST_GEMINI_LATENCY_MS', '800')),
+        float(os.getenv('LOADTEST_GEMINI_JITTER_MS', '200')),
+    )
+
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(predict_bp, url_prefix='/api/predict')
+    app.register_blueprint(routes.chatbot.chatbot_bp, url_prefix='/api/chatbot')
+    app.register_blueprint(profile_bp, url_prefix='/api/profile')
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+    app.register_blueprint(export_bp, url_prefix='/api/export')
+    return app
+
+
+# ==========================================================
+# Server process management
+# ==========================================================
+def _write_random_weights(path):
+    # Only the architecture is needed here; keep the server's env untouched.
+    previous = os.environ.get('MODEL_PRELOAD')
+    os.environ['MODEL_PRELOAD'] = '0'
+    try:
+        sys.path.insert(0, BACKEND_DIR)
+        import torch
+        from model_loader import get_model_architecture
+    finally:
+        if previous is None:
+            del os.environ['MODEL_PRELOAD']
+        else:
+            os.environ['MODEL_PRELOAD'] = previous
+    torch.manual_seed(0)
+    torch.save(get_model_architecture().state_dict(), path)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': BACKEND_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+        'MODEL_PATH': os.path.join(workdir, 'random_weights.pth'),
+        'MODEL_DIR': os.path.join(workdir, 'model_versions'),
+        'LOADTEST_USERS': str(args.users),
+        'LOADTEST_GEMINI_LATENCY_MS': str(args.gemini_latency_ms),
+        'LOADTEST_GEMINI_JITTER_MS': str(args.gemini_jitter_ms),
+        'JWT_SECRET_KEY': env.get('JWT_SECRET_KEY', 'loadtest-jwt-secret-key-0123456789abcdef'),
+    })
+    if args.mongo_uri:
+        env['LOADTEST_MONGO_URI'] = args.mongo_uri
+
+    if args.server == 'gunicorn':
+        # The real gunicorn_config.py supplies workers, worker_class, threads and timeout;
+        # only the bind address (and any explicit overrides) come from the command line.
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(BACKEND_DIR, 'gunicorn_config.py'),
+               '--bind', f'127.0.0.1:{port}']
+        if args.workers:
+            cmd += ['--workers', str(args.workers)]
+        if args.threads:
+            cmd += ['--threads', str(args.threads)]
+        cmd.append('loadtest:create_standin_app()')
+    else:
+        cmd = [sys.executable, '-c',
+               'import loadtest; loadtest.create_standin_app()'
+               f'.run(host="127.0.0.1", port={port}, threaded=True)']
+
+    process = subprocess.Popen(cmd, cwd=workdir, env=env, start_new_session=True)
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited during startup with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('POST', '/api/auth/login', body=json.dumps({
+                'email': SEEDED_EMAIL.format(0), 'password': SEEDED_PASSWORD,
+            }), headers={'Content-Type': 'application/json'})
+            if conn.getresponse().status == 200:
+                return process, port
+        except OSError:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    raise SystemExit("Server did not become ready in time")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+# ==========================================================
+# Load generation
+# ==========================================================
+def _multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class VirtualUser:
+    """One client thread with its own keep-alive connection and login."""
+
+    def __init__(self, port, index, args, images, results):
+        self.port = port
+        self.index = index
+        self.args = args
+        self.images = images
+        self.results = results
+        self.conn = None
+        self.token = None
+        self.email = SEEDED_EMAIL.format(index % args.users)
+
+    def request(self, name, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        started = time.perf_counter()
+        status = None
+        payload = b''
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.args.request_timeout)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            payload = response.read()
+            status = response.status
+            if response.will_close:
+                self.conn.close()
+                self.conn = None
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+        self.results.append((name, time.perf_counter() - started, status))
+        return status, payload
+
+    def post_json(self, name, path, data):
+        return self.request(name, 'POST', path, json.dumps(data), {'Content-Type': 'application/json'})
+
+    def login(self):
+        status, payload = self.post_json('login', '/api/auth/login', {
+            'email': self.email, 'password': SEEDED_PASSWORD,
+        })
+        if status == 200:
+            self.token = json.loads(payload)['token']
+
+    def register(self):
+        token, self.token = self.token, None
+        self.post_json('register', '/api/auth/register', {
+            'name': 'Load Test', 'email': f'loadtest-{uuid.uuid4().hex}@example.com', 'password': 'pw',
+        })
+        self.token = token
+
+    def upload(self):
+        filename, data = random.choice(self.images)
+        body, content_type = _multipart('mriScan', filename, data)
+        self.request('upload', 'POST', '/api/predict/upload', body, {'Content-Type': content_type})
+
+    def run(self, deadline):
+        self.login()
+        actions = {
+            'login': self.login,
+            'register': self.register,
+            'upload': self.upload,
+            'stats': lambda: self.request('stats', 'GET', '/api/predict/stats'),
+            'chat_ask': lambda: self.post_json('chat_ask', '/api/chatbot/ask', {
+                'question': random.choice(['What is an MRI?', 'How accurate is the model?', 'What is a glioma?']),
+            }),
+            'chat_history': lambda: self.request('chat_history', 'GET', '/api/chatbot/history'),
+        }
+        names = list(SCENARIO)
+        weights = [SCENARIO[name] for name in names]
+        while time.perf_counter() < deadline:
+            actions[random.choices(names, weights)[0]]()
+            if self.args.think_time_ms:
+                time.sleep(random.expovariate(1000 / self.args.think_time_ms))
+
+
+def load_images(directory, limit=50):
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )[:limit]
+    if not paths:
+        raise SystemExit(f"No sample images found in {directory}")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def report(results, elapsed):
+    by_endpoint = collections.defaultdict(list)
+    for name, latency, status in results:
+        by_endpoint[name].append((latency, status))
+
+    total_ok = sum(1 for _, _, status in results if status is not None and status < 400)
+    print(f"\nRequests: {len(results)} in {elapsed:.1f}s  ->  {len(results) / elapsed:.1f} req/s "
+          f"({total_ok / elapsed:.1f} successful req/s)")
+    print(f"{'endpoint':<14}{'count':>8}{'req/s':>9}{'err %':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name in SCENARIO:
+        samples = by_endpoint.get(name)
+        if not samples:
+            continue
+        latencies = sorted(latency * 1000 for latency, _ in samples)
+        errors = sum(1 for _, status in samples if status is None or status >= 400)
+        print(f"{name:<14}{len(samples):>8}{len(samples) / elapsed:>9.1f}{100 * errors / len(samples):>8.1f}"
+              f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 90):>9.1f}"
+              f"{percentile(latencies, 99):>9.1f}{latencies[-1]:>9.1f}")
+
+    statuses = collections.Counter(status for _, _, status in results)
+    print("Status codes: " + ", ".join(f"{status or 'conn-error'}: {count}" for status, count in sorted(
+        statuses.items(), key=lambda item: (item[0] is None, item[0] or 0))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask',
+                        help="Threaded Flask dev server, or gunicorn with gunicorn_config.py")
+    parser.add_argument('--workers', type=int, help="Override gunicorn workers")
+    parser.add_argument('--threads', type=int, help="Override gunicorn threads per worker")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30, help="Seconds of measured load")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of unmeasured load first")
+    parser.add_argument('--think-time-ms', type=float, default=0, help="Mean pause between a user's requests")
+    parser.add_argument('--users', type=int, default=20, help="Seeded accounts shared by the virtual users")
+    parser.add_argument('--images', default=SAMPLE_IMAGES_DIR, help="Folder of scans to upload")
+    parser.add_argument('--gemini-latency-ms', type=float, default=800)
+    parser.add_argument('--gemini-jitter-ms', type=float, default=200)
+    parser.add_argument('--mongo-uri', help="Use this MongoDB instead of the in-memory stand-in")
+    parser.add_argument('--request-timeout', type=float, default=130)
+    parser.add_argument('--startup-timeout', type=float, default=180)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    workdir = tempfile.mkdtemp(prefix='spinal-loadtest-')
+    try:
+        print("🧠 Writing random DenseNet121 weights...")
+        _write_random_weights(os.path.join(workdir, 'random_weights.pth'))
+        print(f"🚀 Starting {args.server} server...")
+        process, port = start_server(args, workdir)
+        try:
+            if args.warmup:
+                print(f"🔥 Warming up for {args.warmup:.0f}s...")
+                run_phase(port, args, images, args.warmup)
+            print(f"📈 Measuring {args.concurrency} users for {args.duration:.0f}s...")
+            results, elapsed = run_phase(port, args, images, args.duration)
+            report(results, elapsed)
+        finally:
+            stop_server(process)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_phase(port, args, images, duration):
+    results = []
+    deadline = time.perf_counter() + duration
+    users = [VirtualUser(port, i, args, images, results) for i in range(args.concurrency)]
+    threads = [threading.Thread(target=user.run, args=(deadline,)) for user in users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    main()
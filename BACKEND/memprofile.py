@@ -0,0 +1,446 @@
+# BACKEND/memprofile.py
+"""
+Sampling memory profiler for request handlers.
+
+A sampled request records, for each stage it passes through, the peak and
+retained Python allocations (tracemalloc), the change and peak of process RSS
+(which also covers tensor storage, since PyTorch's CPU allocator isn't traced
+and has no memory stats of its own) and, on GPU, torch's peak allocated
+memory. Stages nest: a stage opened inside another is reported as
+"outer/inner". Every `leak_window` profiled requests the tracemalloc snapshot
+is compared with the previous one and the allocation sites that kept growing
+are reported.
+
+tracemalloc and RSS are process-wide, so a sampled request is measured
+alone. Measurement starts once the request is admitted to an inference slot
+(the route marks that point with admitted()), so a sample never holds other
+requests back while it waits in the admission queue. From there it waits for
+the other admitted profiled requests in the worker to finish, and holds new
+ones back until it is done. Nobody waits longer than EXCLUSIVE_WAIT: a sample
+that can't get the worker to itself runs unmeasured, and a request held back
+that long goes ahead (its allocations then show up in the sample). Routes that
+aren't decorated with memory_profiled keep running and are counted too, so
+for clean figures profile a worker started with one thread
+(gunicorn --threads 1).
+
+Profiling is switched on and off at runtime through a small control file that
+every worker re-reads when it changes, e.g. from the admin API:
+
+    {"sample_rate": 0.05, "leak_window": 50, "frames": 8}
+
+tracemalloc only runs while the sample rate is above zero.
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import torch
+
+CONTROL_FILE = os.getenv('MEMPROFILE_CONTROL', 'memprofile.json')
+# How often a request may stat() the control file for changes
+CONTROL_CHECK_INTERVAL = 1.0
+# How long a sampled request waits for the worker's other requests to drain
+# before giving up and running unprofiled, and how long other requests wait
+# for a sampled one before going ahead anyway
+EXCLUSIVE_WAIT = 2.0
+RECENT_PROFILES = 50
+LEAK_SITES = 20
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss():
+    """Peak RSS since the last reset_rss_peak() (VmHWM), in bytes, or None where unavailable."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def reset_rss_peak():
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class RequestProfile:
+    """Per-stage memory figures for one sampled request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.started = time.time()
+        self.start_traced, _ = tracemalloc.get_traced_memory()
+        self.start_rss = current_rss()
+        self.peak_traced = self.start_traced
+        # Stages currently open, outermost first, with the peaks seen inside them
+        self._open = []
+        tracemalloc.reset_peak()
+        reset_rss_peak()
+
+    def _fold_peaks(self):
+        """
+        Folds the peaks since the last reset into every open stage. Peaks are
+        reset when a stage opens, so an enclosing stage must collect them first.
+        """
+        _, traced_peak = tracemalloc.get_traced_memory()
+        rss_peak = peak_rss()
+        self.peak_traced = max(self.peak_traced, traced_peak)
+        for entry in self._open:
+            entry["traced_peak"] = max(entry["traced_peak"], traced_peak)
+            if rss_peak is not None:
+                entry["rss_peak"] = max(entry["rss_peak"] or 0, rss_peak)
+
+    @contextmanager
+    def stage(self, name):
+        self._fold_peaks()
+        path = "/".join([entry["stage"] for entry in self._open] + [name])
+        traced_before, _ = tracemalloc.get_traced_memory()
+        rss_before = current_rss()
+        entry = {"stage": name, "traced_peak": traced_before, "rss_peak": rss_before}
+        tracemalloc.reset_peak()
+        reset_rss_peak()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._open.append(entry)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._fold_peaks()
+            self._open.pop()
+            traced_after, _ = tracemalloc.get_traced_memory()
+            rss_after = current_rss()
+            stage = {
+                "stage": path,
+                "seconds": round(time.perf_counter() - started, 6),
+                "peak_bytes": entry["traced_peak"] - traced_before,
+                "retained_bytes": traced_after - traced_before,
+                "rss_delta_bytes": rss_after - rss_before if rss_before is not None else None,
+                "rss_peak_delta_bytes": (
+                    entry["rss_peak"] - rss_before if rss_before is not None and entry["rss_peak"] else None
+                ),
+            }
+            if torch.cuda.is_available():
+                stage["cuda_peak_bytes"] = torch.cuda.max_memory_allocated()
+            self.stages.append(stage)
+
+    def describe(self):
+        self._fold_peaks()
+        traced_now, _ = tracemalloc.get_traced_memory()
+        rss_now = current_rss()
+        return {
+            "request": self.name,
+            "started": self.started,
+            "peak_bytes": self.peak_traced - self.start_traced,
+            "retained_bytes": traced_now - self.start_traced,
+            "rss_delta_bytes": rss_now - self.start_rss if self.start_rss is not None else None,
+            "stages": self.stages,
+        }
+
+
+class _NullProfile:
+    @contextmanager
+    def stage(self, name):
+        yield
+
+
+_NULL_PROFILE = _NullProfile()
+
+
+class MemoryProfiler:
+    """
+    Samples requests for memory profiling. tracemalloc is process-wide, so a
+    sampled request is measured with no other admitted profiled request in
+    flight in this worker (see the module docstring).
+    """
+
+    def __init__(self, control_file=CONTROL_FILE):
+        self.control_file = control_file
+        self.sample_rate = 0.0
+        self.leak_window = 50
+        self.frames = 8
+        self._control_mtime = None
+        self._next_check = 0.0
+        self._started_tracing = False
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Admitted profiled requests in flight, and whether a sampled one has the worker to itself
+        self._gate = threading.Condition()
+        self._in_flight = 0
+        self._exclusive = False
+        self._recent = deque(maxlen=RECENT_PROFILES)
+        self._stage_totals = {}
+        self._profiled = 0
+        self._baseline = None
+        self._since_baseline = 0
+        self._leak_report = None
+
+    # --- Runtime control ---
+    def configure(self, sample_rate, leak_window=None, frames=None):
+        """Publishes new settings to every worker through the control file."""
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if leak_window is not None and leak_window < 1:
+            raise ValueError("leak_window must be at least 1")
+        if frames is not None and not 1 <= frames <= 64:
+            raise ValueError("frames must be between 1 and 64")
+        config = {
+            "sample_rate": sample_rate,
+            "leak_window": leak_window or self.leak_window,
+            "frames": frames or self.frames,
+        }
+        directory = os.path.dirname(self.control_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.control_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(config, f)
+        os.replace(tmp_path, self.control_file)
+        self._next_check = 0.0
+        self._sync()
+
+    def _sync(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + CONTROL_CHECK_INTERVAL
+        mtime = _mtime(self.control_file)
+        if mtime == self._control_mtime:
+            return
+        self._control_mtime = mtime
+
+        config = {}
+        if mtime is not None:
+            try:
+                with open(self.control_file) as f:
+                    config = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"❌ ERROR reading memory profiling control file: {e}")
+                return
+        with self._lock:
+            self.sample_rate = float(config.get("sample_rate", 0.0))
+            self.leak_window = int(config.get("leak_window", self.leak_window))
+            frames = int(config.get("frames", self.frames))
+            if self.sample_rate > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self.frames = frames
+                self._started_tracing = True
+                self._baseline, self._since_baseline = None, 0
+                print(f"✅ Memory profiling on ({self.sample_rate:.0%} of requests)")
+            elif self.sample_rate == 0 and self._started_tracing:
+                # Don't pull tracing out from under a request that is being profiled
+                if not self._busy.acquire(blocking=False):
+                    self._control_mtime = -1  # Retry on the next check
+                    return
+                try:
+                    tracemalloc.stop()
+                finally:
+                    self._busy.release()
+                self._started_tracing = False
+                self._baseline = None
+                print("✅ Memory profiling off")
+
+    # --- Request hooks ---
+    @contextmanager
+    def request(self, name):
+        """
+        Samples the enclosed request; if it is sampled, it is measured from
+        admitted() to the end of the request and stages attach via stage().
+        """
+        self._sync()
+        if self.sample_rate <= 0 or not tracemalloc.is_tracing():
+            yield
+            return
+
+        # Only one request per worker can be the sampled one
+        holds_busy = random.random() < self.sample_rate and self._busy.acquire(blocking=False)
+        state = {"name": name, "sample": holds_busy, "counted": False, "profile": None}
+        self._local.request = state
+        try:
+            yield
+        finally:
+            self._local.request = None
+            profile = state["profile"]
+            try:
+                if profile is not None:
+                    self._local.profile = None
+                    self._record(profile.describe())
+                    self._check_leaks()
+            finally:
+                if state["counted"]:
+                    self._leave(profile is not None)
+                if holds_busy:
+                    self._busy.release()
+
+    @contextmanager
+    def admitted(self):
+        """
+        Marks the point where the current profiled request holds its inference
+        slot. A sampled request takes the worker to itself and starts being
+        measured here; other requests count in, waiting out a running sample.
+        A no-op outside a profiled request.
+        """
+        state = getattr(self._local, 'request', None)
+        if state is not None and not state["counted"]:
+            state["counted"], sampled = self._enter(state["sample"])
+            if sampled:
+                state["profile"] = self._local.profile = RequestProfile(state["name"])
+        yield
+
+    def _enter(self, sample):
+        """
+        Counts an admitted request in; a sampled one also waits to have the
+        worker to itself. Returns (counted, sampled).
+        """
+        with self._gate:
+            if not self._gate.wait_for(lambda: not self._exclusive, timeout=EXCLUSIVE_WAIT):
+                # The sample has had long enough; go ahead without being counted
+                return False, False
+            self._in_flight += 1
+            if not sample:
+                return True, False
+            # Hold new requests back and let the ones in flight finish
+            self._exclusive = True
+            if self._gate.wait_for(lambda: self._in_flight == 1, timeout=EXCLUSIVE_WAIT):
+                return True, True
+            self._exclusive = False
+            self._gate.notify_all()
+            return True, False
+
+    def _leave(self, sampled):
+        with self._gate:
+            self._in_flight -= 1
+            if sampled:
+                self._exclusive = False
+            self._gate.notify_all()
+
+    def stage(self, name):
+        """Context manager timing a stage of the current request (a no-op when it isn't sampled)."""
+        profile = getattr(self._local, 'profile', None) or _NULL_PROFILE
+        return profile.stage(name)
+
+    def _record(self, result):
+        with self._lock:
+            self._profiled += 1
+            self._recent.append(result)
+            for stage in result["stages"]:
+                totals = self._stage_totals.setdefault(
+                    (result["request"], stage["stage"]),
+                    {"count": 0, "max_peak_bytes": 0, "peak_bytes_sum": 0, "retained_bytes_sum": 0},
+                )
+                totals["count"] += 1
+                totals["max_peak_bytes"] = max(totals["max_peak_bytes"], stage["peak_bytes"])
+                totals["peak_bytes_sum"] += stage["peak_bytes"]
+                totals["retained_bytes_sum"] += stage["retained_bytes"]
+
+    # --- Leak detection ---
+    def _check_leaks(self):
+        if self._baseline is None:
+            # The first profiled request warms caches; growth is measured from here on.
+            self._baseline = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            self._since_baseline = 0
+            return
+        self._since_baseline += 1
+        if self._since_baseline < self.leak_window:
+            return
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        growth = [diff for diff in snapshot.compare_to(self._baseline, 'traceback') if diff.size_diff > 0]
+        self._leak_report = {
+            "requests": self._since_baseline,
+            "created": time.time(),
+            "total_growth_bytes": sum(diff.size_diff for diff in growth),
+            "sites": [{
+                "size_diff_bytes": diff.size_diff,
+                "count_diff": diff.count_diff,
+                "size_bytes": diff.size,
+                "traceback": [f"{frame.filename}:{frame.lineno}" for frame in diff.traceback],
+            } for diff in growth[:LEAK_SITES]],
+        }
+        self._baseline, self._since_baseline = snapshot, 0
+
+    # --- Reporting ---
+    def report(self):
+        """This worker's profiling summary, recent requests and latest leak report."""
+        self._sync()
+        with self._lock:
+            stages = [{
+                "request": request_name,
+                "stage": stage_name,
+                "count": totals["count"],
+                "max_peak_bytes": totals["max_peak_bytes"],
+                "mean_peak_bytes": totals["peak_bytes_sum"] // totals["count"],
+                "mean_retained_bytes": totals["retained_bytes_sum"] // totals["count"],
+            } for (request_name, stage_name), totals in self._stage_totals.items()]
+            recent = list(self._recent)[-10:]
+        traced, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        return {
+            "pid": os.getpid(),
+            "enabled": tracemalloc.is_tracing() and self.sample_rate > 0,
+            "sample_rate": self.sample_rate,
+            "leak_window": self.leak_window,
+            "frames": self.frames,
+            "profiled_requests": self._profiled,
+            "rss_bytes": current_rss(),
+            "traced_bytes": traced,
+            "stages": stages,
+            "recent": recent,
+            "leaks": self._leak_report,
+            "requests_until_leak_report": (
+                self.leak_window - self._since_baseline if self._baseline is not None else None
+            ),
+        }
+
+
+# Shared per-process profiler used by the routes
+profiler = MemoryProfiler()
+stage = profiler.stage
+admitted = profiler.admitted
+
+
+def memory_profiled(name):
+    """Decorator that samples a view function for memory profiling."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profiler.request(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
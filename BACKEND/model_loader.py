@@ -1,8 +1,16 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchvision import models, transforms
 from PIL import Image
+import hashlib
 import io
+import os
+import time
+
+from model_registry import ModelRegistry
+import torchscript_artifact
+from memprofile import stage as profile_stage
 
 # --- 1. Define the Model Architecture ---
 # This must be the EXACT same architecture you used for training.
@@ -30,41 +38,206 @@ def get_image_transform():
     ])
 
 # --- 3. Load the Model and YOUR Custom Weights ---
-print("🧠 Loading custom-trained PyTorch model...")
+MODEL_PATH = os.getenv('MODEL_PATH', 'densenet_spinal_tumor.pth')
+
+def get_weights_version(path):
+    """Returns a short content hash of a weights file, used to key cached results."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()[:12]
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = get_model_architecture()
 
-# UPDATED: Load the saved weights from YOUR .pth file
-model.load_state_dict(torch.load('densenet_spinal_tumor.pth', map_location=device))
+def load_model(weights_path):
+    """Builds the architecture and loads a weights file onto the device in eval mode."""
+    model = get_model_architecture()
+    model.load_state_dict(torch.load(weights_path, map_location=device))
+    model.to(device)
+    model.eval()  # Set the model to evaluation mode
+    return model
+
+def load_serving_model(weights_path, weights_hash):
+    """Loads the frozen TorchScript artifact built for these weights, or the eager model if there is none."""
+    try:
+        frozen = torchscript_artifact.load(weights_hash, device)
+        if frozen is not None:
+            print(f"✅ Loaded TorchScript artifact for weights {weights_hash}")
+            return frozen
+        if torchscript_artifact.USE_ARTIFACTS:
+            print(f"❌ No TorchScript artifact for weights {weights_hash}, using the eager model "
+                  f"(build one with: python torchscript_artifact.py build)")
+    except Exception as e:
+        print(f"❌ ERROR loading TorchScript artifact, using the eager model: {e}")
+    return load_model(weights_path)
+
+# Batch shapes the API serves: single uploads and every TTA size. oneDNN picks
+# kernels per input shape, and the TorchScript executor profiles new shapes.
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv('MODEL_WARMUP_BATCH_SIZES', '1,2,3,4,5,6,7,8').split(',')]
+
+def warmup_model(model, rounds=2, batch_sizes=None):
+    """Runs synthetic batches of every expected shape so the first real requests don't pay for kernel warmup."""
+    with torch.no_grad():
+        for i, batch_size in enumerate(batch_sizes or WARMUP_BATCH_SIZES):
+            batch = torch.zeros(batch_size, 3, 224, 224, device=device)
+            # Allocator and graph warmup happen once; each further shape needs a single pass
+            for _ in range(rounds if i == 0 else 1):
+                forward_with_embedding(model, batch)
 
-model.to(device)
-model.eval()  # Set the model to evaluation mode
-print("✅ Custom model loaded successfully!")
+def predict_probability(model, image_tensor):
+    """Runs a single forward pass and returns the tumor probability."""
+    with torch.no_grad():
+        # The output is a probability between 0 and 1
+        return model(image_tensor).item()
+
+def forward_with_embedding(model, image_tensor):
+    """
+    Runs DenseNet121's forward pass step by step so the pooled 1024-d feature
+    vector that feeds model.classifier is kept. Returns (probabilities, embeddings).
+    """
+    with torch.no_grad():
+        if hasattr(model, 'with_embedding'):
+            # A frozen TorchScript artifact computes both in one call
+            return model.with_embedding(image_tensor)
+        features = F.relu(model.features(image_tensor))
+        embeddings = F.adaptive_avg_pool2d(features, (1, 1)).flatten(1)
+        probabilities = model.classifier(embeddings).view(-1)
+    return probabilities, embeddings
+
+def predict_batch(model, batch_tensor):
+    """Runs one forward pass over a batch and returns a list of tumor probabilities."""
+    with torch.no_grad():
+        return model(batch_tensor.to(device)).view(-1).tolist()
+
+# The registry owns the serving model so new versions can be swapped in
+# without restarting the worker (see model_registry.py).
+registry = ModelRegistry(
+    load_fn=load_serving_model,
+    eager_fn=load_model,
+    hash_fn=get_weights_version,
+    warmup_fn=warmup_model,
+    predict_fn=predict_probability,
+    default_path=MODEL_PATH,
+)
+
+# Set MODEL_PRELOAD=0 for tools that only need the definitions above;
+# the model is then loaded on first use instead of at import.
+if os.getenv('MODEL_PRELOAD', '1') != '0':
+    print("🧠 Loading custom-trained PyTorch model...")
+    registry.start()
+    print("✅ Custom model loaded successfully!")
 
 # --- 4. Prediction Function ---
-def make_prediction(image_bytes):
+def preprocess_image(image_bytes):
+    """Decodes image bytes into a normalized (1, 3, 224, 224) tensor on the device."""
+    transform = get_image_transform()
+    # Each step is a separate memory-profiling stage (a no-op unless the request is sampled)
+    with profile_stage("buffer"):
+        buffer = io.BytesIO(image_bytes)
+    # Open the image from the bytes received in the request
+    with profile_stage("decode"):
+        image = Image.open(buffer)
+        image.load()
+    with profile_stage("grayscale"):
+        image = image.convert('L') # Convert to grayscale
+
+    # Apply transformations and add a batch dimension
+    with profile_stage("tensor"):
+        return transform(image).unsqueeze(0).to(device)
+
+def make_prediction(image_bytes, return_embedding=False, loaded=None):
     """
     Takes image bytes, preprocesses the image, and returns a prediction.
+    With return_embedding=True the scan's 1024-d feature vector is appended
+    to the result as a float32 NumPy array. `loaded` pins the registry entry
+    to score with (default: whichever version is active now).
     """
     try:
-        transform = get_image_transform()
-        # Open the image from the bytes received in the request
-        image = Image.open(io.BytesIO(image_bytes)).convert('L') # Convert to grayscale
-        
-        # Apply transformations and add a batch dimension
-        image_tensor = transform(image).unsqueeze(0).to(device)
-
-        # Make a prediction
-        with torch.no_grad():
-            output = model(image_tensor)
-            # The output is a probability between 0 and 1
-            probability = output.item()
-            
-            # Set a threshold to decide the class
-            prediction = 1 if probability > 0.5 else 0
-            
+        image_tensor = preprocess_image(image_bytes)
+
+        # Make a prediction with whichever version is active right now
+        loaded = loaded or registry.active()
+        started = time.perf_counter()
+        with profile_stage("forward"):
+            probabilities, embeddings = forward_with_embedding(loaded.model, image_tensor)
+        probability = probabilities.item()
+        latency = time.perf_counter() - started
+        loaded.record_latency(latency)
+
+        # Set a threshold to decide the class
+        prediction = 1 if probability > 0.5 else 0
+
+        # Optionally score the same input with the shadow candidate off-thread
+        registry.shadow_score(image_tensor, probability, latency)
+
+        if return_embedding:
+            return prediction, probability, embeddings[0].cpu().numpy()
         return prediction, probability
 
     except Exception as e:
         print(f"Error during prediction: {e}")
-        return None, None
+        return (None, None, None) if return_embedding else (None, None)
+
+# --- 5. Test-Time Augmentation ---
+MAX_TTA_AUGMENTATIONS = 8
+TTA_SHIFT = 8  # pixels
+TTA_CROP = 200  # pixels kept by the zoom-in crops before resizing back to 224
+
+def _shift(image_tensor, dx, dy):
+    """Translates the image, filling the uncovered border by replicating edge pixels."""
+    pad = (max(dx, 0), max(-dx, 0), max(dy, 0), max(-dy, 0))
+    padded = F.pad(image_tensor, pad, mode='replicate')
+    height, width = image_tensor.shape[-2:]
+    top, left = max(-dy, 0), max(-dx, 0)
+    return padded[..., top:top + height, left:left + width]
+
+def _zoom(image_tensor, top, left):
+    size = image_tensor.shape[-1]
+    crop = image_tensor[..., top:top + TTA_CROP, left:left + TTA_CROP]
+    return F.interpolate(crop, size=(size, size), mode='bilinear', align_corners=False)
+
+def build_tta_batch(image_tensor, num_augmentations):
+    """
+    Stacks the preprocessed scan and up to MAX_TTA_AUGMENTATIONS - 1 variants
+    (flip, small shifts, zoomed crops) into one batch, original first.
+    """
+    margin = image_tensor.shape[-1] - TTA_CROP
+    views = [
+        lambda x: x,
+        lambda x: torch.flip(x, dims=[3]),
+        lambda x: _shift(x, TTA_SHIFT, 0),
+        lambda x: _shift(x, -TTA_SHIFT, 0),
+        lambda x: _shift(x, 0, TTA_SHIFT),
+        lambda x: _shift(x, 0, -TTA_SHIFT),
+        lambda x: _zoom(x, margin // 2, margin // 2),
+        lambda x: torch.flip(_zoom(x, margin // 2, margin // 2), dims=[3]),
+    ]
+    return torch.cat([view(image_tensor) for view in views[:num_augmentations]])
+
+def make_tta_prediction(image_bytes, num_augmentations, return_embedding=False, loaded=None):
+    """
+    Scores the scan and its augmentations in a single batched forward pass.
+    Returns (prediction, mean probability, standard deviation), or Nones on error;
+    with return_embedding=True the unaugmented scan's feature vector is appended.
+    `loaded` is as for make_prediction.
+    """
+    try:
+        num_augmentations = max(1, min(num_augmentations, MAX_TTA_AUGMENTATIONS))
+        batch = build_tta_batch(preprocess_image(image_bytes), num_augmentations)
+        loaded = loaded or registry.active()
+        started = time.perf_counter()
+        with profile_stage("forward"):
+            probabilities, embeddings = forward_with_embedding(loaded.model, batch)
+        loaded.record_latency(time.perf_counter() - started)
+
+        probability = probabilities.mean().item()
+        spread = probabilities.std(unbiased=False).item()
+        prediction = 1 if probability > 0.5 else 0
+        if return_embedding:
+            return prediction, probability, spread, embeddings[0].cpu().numpy()
+        return prediction, probability, spread
+
+    except Exception as e:
+        print(f"Error during TTA prediction: {e}")
+        return (None, None, None, None) if return_embedding else (None, None, None)
@@ -0,0 +1,362 @@
+# BACKEND/model_registry.py
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Registry layout ---
+# Versioned weight files live in MODEL_DIR as <version>.pth. Two small pointer
+# files in the same folder tell every gunicorn worker what to serve:
+#   ACTIVE  -> name of the version that answers user requests
+#   SHADOW  -> {"version": ..., "sample_rate": ...} for the candidate, if any
+# Workers poll the pointers, so an admin swap on one worker reaches all of them.
+MODEL_DIR = os.getenv('MODEL_DIR', 'model_versions')
+ACTIVE_POINTER = os.path.join(MODEL_DIR, 'ACTIVE')
+SHADOW_POINTER = os.path.join(MODEL_DIR, 'SHADOW')
+POLL_INTERVAL = float(os.getenv('MODEL_POLL_INTERVAL', '5'))
+SHADOW_HISTORY = 1000
+# Shadow jobs queued or running per worker; each holds an image tensor, so
+# samples beyond this are dropped rather than queued when the candidate is slow
+SHADOW_MAX_PENDING = int(os.getenv('MODEL_SHADOW_MAX_PENDING', '8'))
+
+
+class LoadedModel:
+    """A warmed-up model together with the version it was loaded from."""
+
+    def __init__(self, version, path, weights_hash, model, eager_fn=None, load_seconds=None, warmup_seconds=None):
+        self.version = version
+        self.path = path
+        self.weights_hash = weights_hash
+        self.model = model
+        # 'torchscript' when serving a frozen artifact, otherwise the eager nn.Module
+        self.mode = getattr(model, 'serving_mode', 'eager')
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+        self.warmup_seconds = warmup_seconds
+        self.first_request_ms = None
+        self._eager_fn = eager_fn
+        self._eager = None
+        self._eager_lock = threading.Lock()
+
+    def eager(self):
+        """
+        The eager nn.Module for these weights, for code that needs its layers
+        (Grad-CAM). When serving an artifact it is loaded on first use.
+        """
+        if self.mode == 'eager':
+            return self.model
+        with self._eager_lock:
+            if self._eager is None:
+                self._eager = self._eager_fn(self.path)
+            return self._eager
+
+    def record_latency(self, latency):
+        # Only the first request matters here; it shows whether warmup covered it
+        if self.first_request_ms is None:
+            self.first_request_ms = round(latency * 1000, 1)
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "weights_hash": self.weights_hash,
+            "mode": self.mode,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "first_request_ms": self.first_request_ms,
+        }
+
+
+def _write_pointer(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _read_pointer(path):
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class ModelRegistry:
+    """
+    Holds the model that serves requests and swaps it without blocking them.
+
+    New versions are loaded and warmed on a background thread; the switch
+    itself is a single reference assignment, so in-flight requests finish on
+    the old model and the next request picks up the new one.
+    """
+
+    def __init__(self, load_fn, hash_fn, warmup_fn, predict_fn, default_path, eager_fn=None):
+        # load_fn(path, weights_hash) may return a frozen artifact; eager_fn(path)
+        # always builds the nn.Module (see LoadedModel.eager)
+        self._load_fn = load_fn
+        self._eager_fn = eager_fn
+        self._hash_fn = hash_fn
+        self._warmup_fn = warmup_fn
+        self._predict_fn = predict_fn
+        self._default_path = default_path
+        self._default_version = os.path.splitext(os.path.basename(default_path))[0]
+
+        self._active = None
+        self._target_version = None
+        self._candidate = None
+        self._shadow_version = None
+        self._shadow_rate = 0.0
+        self._pending = None
+        self._swapping = False
+        self._init_lock = threading.Lock()
+        # Guards _target_version, _pending and _swapping
+        self._state_lock = threading.Lock()
+        self._poller = None
+        self._pointer_mtimes = (None, None)
+
+        # Shadow scoring runs on one background thread so it never competes
+        # with more than a single request thread for the CPU.
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        self._shadow_lock = threading.Lock()
+        self._shadow_results = deque(maxlen=SHADOW_HISTORY)
+        self._shadow_pending = 0
+        self._shadow_dropped = 0
+        self._shadow_recorder = None
+
+    # --- Versions ---
+    def available_versions(self):
+        """Maps version names to weight files, including the bundled default."""
+        versions = {self._default_version: self._default_path}
+        if os.path.isdir(MODEL_DIR):
+            for name in sorted(os.listdir(MODEL_DIR)):
+                if name.endswith('.pth'):
+                    versions[name[:-len('.pth')]] = os.path.join(MODEL_DIR, name)
+        return versions
+
+    def _load_version(self, version):
+        path = self.available_versions().get(version)
+        if path is None:
+            raise ValueError(f"Unknown model version: {version}")
+        weights_hash = self._hash_fn(path)
+        started = time.perf_counter()
+        model = self._load_fn(path, weights_hash)
+        loaded = time.perf_counter()
+        self._warmup_fn(model)
+        warmed = time.perf_counter()
+        print(f"✅ Model '{version}' ({getattr(model, 'serving_mode', 'eager')}) loaded in "
+              f"{loaded - started:.2f}s, warmed up in {warmed - loaded:.2f}s")
+        return LoadedModel(version, path, weights_hash, model, eager_fn=self._eager_fn,
+                           load_seconds=round(loaded - started, 3), warmup_seconds=round(warmed - loaded, 3))
+
+    # --- Startup ---
+    def start(self):
+        """Loads and warms the active version, then starts watching the pointers."""
+        with self._init_lock:
+            if self._active is not None:
+                return
+            version = _read_pointer(ACTIVE_POINTER) or self._default_version
+            try:
+                self._active = self._load_version(version)
+            except Exception as e:
+                print(f"❌ ERROR loading model version '{version}', using default: {e}")
+                self._active = self._load_version(self._default_version)
+            with self._state_lock:
+                self._target_version = self._active.version
+            print(f"✅ Serving model version '{self._active.version}'")
+
+            self._pointer_mtimes = (_mtime(ACTIVE_POINTER), _mtime(SHADOW_POINTER))
+            self._sync_shadow()
+            self._poller = threading.Thread(target=self._poll_pointers, name='model-registry', daemon=True)
+            self._poller.start()
+
+    def active(self):
+        """Returns the LoadedModel that should answer the current request."""
+        if self._active is None:
+            self.start()
+        return self._active
+
+    # --- Swapping ---
+    def request_swap(self, version):
+        """Publishes a new active version to every worker and starts loading it here."""
+        if version not in self.available_versions():
+            raise ValueError(f"Unknown model version: {version}")
+        _write_pointer(ACTIVE_POINTER, version)
+        self._swap_in_background(version)
+
+    def _swap_in_background(self, version):
+        # Both the admin call and the pointer poller land here; load each target once.
+        with self._state_lock:
+            if version == self._target_version:
+                return
+            self._target_version = version
+            self._pending = version
+            if self._swapping:
+                # The running swap thread picks up the latest request when it finishes.
+                return
+            self._swapping = True
+        threading.Thread(target=self._swap, name='model-swap', daemon=True).start()
+
+    def _swap(self):
+        while True:
+            with self._state_lock:
+                version, self._pending = self._pending, None
+                if version is None:
+                    # Checked and cleared under the lock, so no request can slip in unseen.
+                    self._swapping = False
+                    return
+            started = time.perf_counter()
+            try:
+                loaded = self._load_version(version)
+            except Exception as e:
+                print(f"❌ ERROR loading model version '{version}': {e}")
+                # Keep serving the current version and allow the swap to be retried,
+                # unless a newer target arrived meanwhile.
+                with self._state_lock:
+                    if self._pending is None:
+                        self._target_version = self._active.version if self._active else None
+            else:
+                previous, self._active = self._active, loaded
+                print(f"✅ Swapped model '{previous.version if previous else None}' -> "
+                      f"'{version}' (loaded in {time.perf_counter() - started:.1f}s)")
+
+    # --- Shadow scoring ---
+    def set_shadow(self, version, sample_rate):
+        """Publishes a shadow candidate; pass version=None to turn shadow mode off."""
+        if version is not None and version not in self.available_versions():
+            raise ValueError(f"Unknown model version: {version}")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        _write_pointer(SHADOW_POINTER, json.dumps({"version": version, "sample_rate": sample_rate}))
+        self._sync_shadow()
+
+    def set_shadow_recorder(self, recorder):
+        """Registers a callable that persists each shadow comparison."""
+        self._shadow_recorder = recorder
+
+    def _sync_shadow(self):
+        config = _read_pointer(SHADOW_POINTER)
+        config = json.loads(config) if config else {}
+        version = config.get("version")
+        self._shadow_rate = float(config.get("sample_rate", 0.0)) if version else 0.0
+
+        if version == self._shadow_version:
+            return
+        self._shadow_version = version
+        self._candidate = None
+        if version is not None:
+            threading.Thread(target=self._load_candidate, args=(version,), name='model-shadow-load', daemon=True).start()
+
+    def _load_candidate(self, version):
+        try:
+            candidate = self._load_version(version)
+            # Shadow mode may have been switched off or retargeted meanwhile.
+            if self._shadow_version != version:
+                return
+            self._candidate = candidate
+            print(f"✅ Shadow candidate '{version}' ready")
+        except Exception as e:
+            print(f"❌ ERROR loading shadow candidate '{version}': {e}")
+
+    def shadow_score(self, image_tensor, probability, latency):
+        """Samples a request for background scoring by the shadow candidate."""
+        candidate = self._candidate
+        if candidate is None or random.random() >= self._shadow_rate:
+            return
+        with self._shadow_lock:
+            if self._shadow_pending >= SHADOW_MAX_PENDING:
+                self._shadow_dropped += 1
+                return
+            self._shadow_pending += 1
+        primary_version = self._active.version
+        self._shadow_executor.submit(
+            self._run_shadow, candidate, image_tensor, probability, latency, primary_version
+        )
+
+    def _run_shadow(self, candidate, image_tensor, probability, latency, primary_version):
+        try:
+            started = time.perf_counter()
+            candidate_probability = self._predict_fn(candidate.model, image_tensor)
+            candidate_latency = time.perf_counter() - started
+        except Exception as e:
+            print(f"❌ ERROR during shadow scoring: {e}")
+            return
+        finally:
+            with self._shadow_lock:
+                self._shadow_pending -= 1
+
+        result = {
+            "primary_version": primary_version,
+            "candidate_version": candidate.version,
+            "agree": (probability > 0.5) == (candidate_probability > 0.5),
+            "probability_delta": candidate_probability - probability,
+            "latency_delta_ms": (candidate_latency - latency) * 1000,
+            "timestamp": time.time(),
+        }
+        with self._shadow_lock:
+            self._shadow_results.append(result)
+        if self._shadow_recorder is not None:
+            try:
+                self._shadow_recorder(dict(result))
+            except Exception as e:
+                print(f"❌ ERROR recording shadow result: {e}")
+
+    def shadow_stats(self):
+        """Summarizes this worker's recent shadow comparisons."""
+        with self._shadow_lock:
+            results = list(self._shadow_results)
+            pending, dropped = self._shadow_pending, self._shadow_dropped
+        summary = {
+            "candidate": self._candidate.describe() if self._candidate else None,
+            "sample_rate": self._shadow_rate,
+            "samples": len(results),
+            "pending": pending,
+            # Sampled requests skipped because SHADOW_MAX_PENDING jobs were already queued
+            "dropped": dropped,
+        }
+        if results:
+            latency_deltas = sorted(r["latency_delta_ms"] for r in results)
+            summary.update({
+                "agreement_rate": sum(r["agree"] for r in results) / len(results),
+                "mean_probability_delta": sum(r["probability_delta"] for r in results) / len(results),
+                "latency_delta_ms_p50": latency_deltas[len(latency_deltas) // 2],
+                "latency_delta_ms_p95": latency_deltas[min(len(latency_deltas) - 1, int(len(latency_deltas) * 0.95))],
+            })
+        return summary
+
+    # --- Pointer watching ---
+    def _poll_pointers(self):
+        while True:
+            time.sleep(POLL_INTERVAL)
+            try:
+                mtimes = (_mtime(ACTIVE_POINTER), _mtime(SHADOW_POINTER))
+                if mtimes == self._pointer_mtimes:
+                    continue
+                active_changed = mtimes[0] != self._pointer_mtimes[0]
+                shadow_changed = mtimes[1] != self._pointer_mtimes[1]
+                self._pointer_mtimes = mtimes
+                if active_changed:
+                    version = _read_pointer(ACTIVE_POINTER) or self._default_version
+                    self._swap_in_background(version)
+                if shadow_changed:
+                    self._sync_shadow()
+            except Exception as e:
+                print(f"❌ ERROR watching model pointers: {e}")
+
+    def describe(self):
+        return {
+            "active": self._active.describe() if self._active else None,
+            "available": sorted(self.available_versions()),
+            "shadow": self.shadow_stats(),
+        }
@@ -0,0 +1,35 @@
+# BACKEND/permissions.py
+import os
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from auth_cache import user_cache
+
+# Comma-separated list of account emails allowed to use the admin endpoints
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv('ADMIN_EMAILS', '').split(',')
+    if email.strip()
+}
+
+
+def is_admin(identity):
+    if not identity or not ADMIN_EMAILS:
+        return False
+    if str(identity).lower() in ADMIN_EMAILS:
+        return True
+    # app.py identifies users by ObjectId string; check the account's email instead
+    user = user_cache.get(identity)
+    return bool(user) and str(user.get('email', '')).lower() in ADMIN_EMAILS
+
+
+def admin_required(fn):
+    """Like @jwt_required(), but also requires the caller to be listed in ADMIN_EMAILS."""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if not is_admin(get_jwt_identity()):
+            return jsonify({"msg": "Admin access required"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,142 @@
+# routes/admin.py
+from flask import Blueprint, request, jsonify
+
+# ✅ Absolute imports (BACKEND is the top-level package)
+from model_loader import registry
+from permissions import admin_required
+from memprofile import profiler as memory_profiler
+from admission import inference_admission
+from db import database, pool_stats
+from auth_cache import user_cache, revocations
+
+admin_bp = Blueprint('admin_bp', __name__)
+
+
+def _record_shadow_result(result):
+    database.shadow_scores.insert_one(result)
+
+# Persist every shadow comparison so results from all workers can be summarized
+registry.set_shadow_recorder(_record_shadow_result)
+
+# --- Assign a user to an organization (scopes analytics and similar-case search) ---
+@admin_bp.route('/users/<email>/organization', methods=['PUT'])
+@admin_required
+def set_organization(email):
+    data = request.get_json() or {}
+    organization = data.get('organization') or None
+    if organization is not None and not isinstance(organization, str):
+        return jsonify({"msg": "organization must be a string or null"}), 400
+
+    update = {"$set": {"organization": organization}} if organization else {"$unset": {"organization": ""}}
+    result = database.users.update_one({"email": email}, update)
+    if result.matched_count == 0:
+        return jsonify({"msg": "User not found"}), 404
+    user_cache.invalidate(email)
+
+    # Existing predictions keep the organization they were made under
+    return jsonify({"email": email, "organization": organization}), 200
+
+# --- Model registry overview ---
+@admin_bp.route('/models', methods=['GET'])
+@admin_required
+def list_models():
+    return jsonify(registry.describe()), 200
+
+# --- Swap the active model (loads and warms in the background) ---
+@admin_bp.route('/models/activate', methods=['POST'])
+@admin_required
+def activate_model():
+    data = request.get_json() or {}
+    version = data.get('version')
+    if not version:
+        return jsonify({"msg": "Missing version"}), 400
+
+    try:
+        registry.request_swap(version)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 404
+
+    return jsonify({"msg": f"Loading model version '{version}'; workers will switch once it is warm."}), 202
+
+# --- Configure shadow scoring for a candidate model ---
+@admin_bp.route('/models/shadow', methods=['POST'])
+@admin_required
+def configure_shadow():
+    data = request.get_json() or {}
+    version = data.get('version')
+    try:
+        sample_rate = float(data.get('sample_rate', 0.1))
+        registry.set_shadow(version, sample_rate if version else 0.0)
+    except (TypeError, ValueError) as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if not version:
+        return jsonify({"msg": "Shadow scoring disabled"}), 200
+    return jsonify({"msg": f"Shadow scoring '{version}' on {sample_rate:.0%} of requests"}), 202
+
+# --- Shadow scoring results across all workers ---
+@admin_bp.route('/models/shadow/stats', methods=['GET'])
+@admin_required
+def shadow_stats():
+    try:
+        match = {}
+        if request.args.get('candidate'):
+            match["candidate_version"] = request.args['candidate']
+
+        summary = list(database.shadow_scores.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"primary": "$primary_version", "candidate": "$candidate_version"},
+                "samples": {"$sum": 1},
+                "agreement_rate": {"$avg": {"$cond": ["$agree", 1, 0]}},
+                "mean_probability_delta": {"$avg": "$probability_delta"},
+                "mean_latency_delta_ms": {"$avg": "$latency_delta_ms"},
+            }}
+        ]))
+        for item in summary:
+            item.update(item.pop("_id"))
+
+        return jsonify({"worker": registry.shadow_stats(), "all_workers": summary}), 200
+    except Exception as e:
+        print(f"Error fetching shadow stats: {e}")
+        return jsonify({"msg": "An error occurred fetching shadow statistics"}), 500
+
+# --- Memory profiling (toggled for all workers, reported per worker) ---
+@admin_bp.route('/memprofile', methods=['GET'])
+@admin_required
+def memprofile_report():
+    return jsonify(memory_profiler.report()), 200
+
+@admin_bp.route('/memprofile', methods=['POST'])
+@admin_required
+def configure_memprofile():
+    data = request.get_json() or {}
+    try:
+        sample_rate = float(data.get('sample_rate', 0.0))
+        leak_window = int(data['leak_window']) if data.get('leak_window') is not None else None
+        frames = int(data['frames']) if data.get('frames') is not None else None
+        memory_profiler.configure(sample_rate, leak_window, frames)
+    except (TypeError, ValueError) as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if sample_rate == 0:
+        return jsonify({"msg": "Memory profiling disabled"}), 200
+    return jsonify({"msg": f"Memory profiling {sample_rate:.0%} of requests on every worker"}), 200
+
+# --- Inference admission control (this worker) ---
+@admin_bp.route('/admission', methods=['GET'])
+@admin_required
+def admission_stats():
+    return jsonify(inference_admission.describe()), 200
+
+# --- MongoDB connection pool (this worker) ---
+@admin_bp.route('/db/pool', methods=['GET'])
+@admin_required
+def db_pool_stats():
+    return jsonify(pool_stats()), 200
+
+# --- Auth caches (this worker) ---
+@admin_bp.route('/auth/cache', methods=['GET'])
+@admin_required
+def auth_cache_stats():
+    return jsonify({"users": user_cache.stats(), "revocations": revocations.stats()}), 200
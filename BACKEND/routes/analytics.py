@@ -0,0 +1,72 @@
+# routes/analytics.py
+import datetime
+from flask import Blueprint, request, jsonify
+
+# ✅ Absolute imports (BACKEND is the top-level package)
+from analytics import read_rollups, bucket_start, HISTOGRAM_BINS
+from permissions import admin_required
+from db import database
+
+analytics_bp = Blueprint('analytics_bp', __name__)
+
+# Longest range one request may ask for, in buckets
+MAX_BUCKETS = {'hour': 24 * 31, 'day': 366 * 2}
+BUCKET_LENGTH = {'hour': datetime.timedelta(hours=1), 'day': datetime.timedelta(days=1)}
+
+
+def _parse_date(value):
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date '{value}'; use YYYY-MM-DD or YYYY-MM-DD HH:MM")
+
+
+# --- Clinic-wide trends from the hourly/daily rollups ---
+@analytics_bp.route('/summary', methods=['GET'])
+@admin_required
+def summary():
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in BUCKET_LENGTH:
+        return jsonify({"msg": "granularity must be 'hour' or 'day'"}), 400
+    step = BUCKET_LENGTH[granularity]
+
+    try:
+        # end is exclusive; by default the range covers the current bucket and the ones before it
+        end = _parse_date(request.args['end']) if request.args.get('end') else datetime.datetime.now() + step
+        end = bucket_start(end, granularity)
+        if request.args.get('start'):
+            start = bucket_start(_parse_date(request.args['start']), granularity)
+        else:
+            start = end - step * (24 if granularity == 'hour' else 30)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    if start >= end:
+        return jsonify({"msg": "start must be before end"}), 400
+    if (end - start) / step > MAX_BUCKETS[granularity]:
+        return jsonify({"msg": f"At most {MAX_BUCKETS[granularity]} {granularity} buckets per request"}), 400
+
+    try:
+        organization = request.args.get('organization') or None
+        series = read_rollups(database, granularity, start, end, organization)
+
+        uploads = sum(item["uploads"] for item in series)
+        tumor = sum(item["tumor"] for item in series)
+        histogram = [sum(item["confidence_histogram"][i] for item in series) for i in range(HISTOGRAM_BINS)]
+        return jsonify({
+            "granularity": granularity,
+            "organization": organization,
+            "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+            "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+            "totals": {
+                "uploads": uploads,
+                "tumor": tumor,
+                "tumor_rate": round(tumor / uploads, 4) if uploads else None,
+                "confidence_histogram": histogram,
+            },
+            "series": series,
+        }), 200
+    except Exception as e:
+        print(f"Error fetching analytics: {e}")
+        return jsonify({"msg": "An error occurred fetching analytics"}), 500
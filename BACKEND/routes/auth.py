@@ -1,13 +1,14 @@
 # routes/auth.py
 import os
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity
 from google.oauth2 import id_token
 from google.auth.transport import requests
 
 # ✅ Correct import (since extensions.py is in BACKEND folder, not in routes/)
-from extensions import mongo
+from db import database
+from auth_cache import user_cache, revocations, user_filter
 
 auth_bp = Blueprint('auth_bp', __name__)
 
@@ -28,7 +29,7 @@ def google_login():
         email = idinfo['email']
         name = idinfo['name']
         
-        users = mongo.db.users
+        users = database.users
         user = users.find_one({'email': email})
 
         if not user:
@@ -58,7 +59,7 @@ def register():
     if not all([name, email, password]):
         return jsonify({"msg": "Missing required fields"}), 400
 
-    users = mongo.db.users
+    users = database.users
     if users.find_one({'email': email}):
         return jsonify({"msg": "User with this email already exists"}), 409
 
@@ -78,7 +79,7 @@ def login():
     if not email or not password:
         return jsonify({"msg": "Missing email or password"}), 400
 
-    users = mongo.db.users
+    users = database.users
     user = users.find_one({'email': email})
 
     # Use the standard, secure check. This will work for all newly created users.
@@ -87,3 +88,49 @@ def login():
         return jsonify(token=access_token, user={'name': user['name'], 'email': user['email']})
 
     return jsonify({"msg": "Bad email or password"}), 401
+
+# --- Logout: revoke the current token ---
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    try:
+        revocations.revoke_token(get_jwt())
+    except Exception as e:
+        print(f"An error occurred during logout: {e}")
+        return jsonify({"msg": "An internal server error occurred"}), 500
+    return jsonify({"msg": "Logged out"}), 200
+
+# --- Password change: revokes every token issued before it ---
+@auth_bp.route('/change-password', methods=['POST'])
+@jwt_required()
+def change_password():
+    data = request.get_json() or {}
+    current_password = data.get('currentPassword')
+    new_password = data.get('newPassword')
+    if not current_password or not new_password:
+        return jsonify({"msg": "Missing current or new password"}), 400
+
+    # The caller may hold an email token (blueprints) or an ObjectId token (app.py)
+    users = database.users
+    user = users.find_one(user_filter(get_jwt_identity()))
+    if not user or not check_password_hash(user.get('password', ''), current_password):
+        return jsonify({"msg": "Current password is incorrect"}), 401
+    email = user['email']
+
+    try:
+        users.update_one(
+            {'_id': user['_id']},
+            {'$set': {'password': generate_password_hash(new_password, method='pbkdf2:sha256')}}
+        )
+        # Tokens name the account by either identity form; revoke both
+        token_lifetime = current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES')
+        for identity in (email, str(user['_id'])):
+            revocations.revoke_all_before(identity, token_lifetime)
+        user_cache.invalidate(email, str(user['_id']))
+    except Exception as e:
+        print(f"An error occurred changing the password: {e}")
+        return jsonify({"msg": "An internal server error occurred"}), 500
+
+    # Other sessions are signed out; this one continues with a fresh token
+    access_token = create_access_token(identity=email)
+    return jsonify(msg="Password changed", token=access_token), 200
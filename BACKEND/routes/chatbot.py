@@ -6,7 +6,7 @@ from datetime import datetime
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 # ✅ Absolute import for Render deployment
-from extensions import mongo
+from db import database
 
 chatbot_bp = Blueprint('chatbot_bp', __name__)
 
@@ -55,7 +55,7 @@ def ask_chatbot():
         print(f"❌ ERROR: Gemini API call failed: {e}")
         answer = "Sorry, I'm having trouble thinking right now. Please try again."
 
-    mongo.db.chats.insert_one({
+    database.chats.insert_one({
         "userId": user_identity,
         "question": question,
         "answer": answer,
@@ -68,7 +68,7 @@ def ask_chatbot():
 @jwt_required()
 def get_chat_history():
     user_identity = get_jwt_identity()
-    history = list(mongo.db.chats.find({"userId": user_identity}).sort("timestamp", -1))
+    history = list(database.chats.find({"userId": user_identity}).sort("timestamp", -1))
     
     response = [
         {
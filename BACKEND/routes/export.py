@@ -0,0 +1,100 @@
+# routes/export.py
+import os
+import datetime
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from pymongo import ASCENDING
+from werkzeug.utils import secure_filename
+
+# ✅ Absolute imports (BACKEND is the top-level package)
+from export import stream_export, SERIALIZERS
+from permissions import is_admin
+from db import database
+from auth_cache import user_cache
+
+export_bp = Blueprint('export_bp', __name__)
+
+# Documents fetched per round trip to Mongo while streaming
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))
+
+PREDICTION_FIELDS = [
+    "id", "filename", "result", "confidence", "confidence_spread", "augmentations",
+    "model_version", "image_hash", "date",
+]
+CHAT_FIELDS = ["id", "question", "answer", "timestamp"]
+
+_indexes_ready = False
+
+
+def _ensure_indexes():
+    # Exports filter on the owner and walk _id in order; without these indexes
+    # every export scans the collection and sorts it in memory.
+    global _indexes_ready
+    if not _indexes_ready:
+        database.predictions.create_index([("user_id", ASCENDING), ("_id", ASCENDING)])
+        database.chats.create_index([("userId", ASCENDING), ("_id", ASCENDING)])
+        _indexes_ready = True
+
+
+def _export_options():
+    """Reads format/gzip/user from the query string; returns (options, error response)."""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in SERIALIZERS:
+        return None, (jsonify({"msg": "format must be 'csv' or 'ndjson'"}), 400)
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    # Records are stored under the owner's email; app.py tokens carry the ObjectId instead
+    identity = get_jwt_identity()
+    own_email = (user_cache.get(identity) or {}).get('email', identity)
+    # Auditors (admins) may export another user's records
+    user = request.args.get('user') or own_email
+    if user != own_email and not is_admin(identity):
+        return None, (jsonify({"msg": "Admin access required"}), 403)
+    return (export_format, compress, user), None
+
+
+def _streamed(cursor, fields, name, export_format, compress, user):
+    chunks, mimetype, extension = stream_export(cursor, fields, export_format, compress)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    # `user` may come from an admin's query string; keep the header value to safe characters
+    owner = secure_filename(user.split('@')[0]) or "user"
+    filename = f"{name}-{owner}-{stamp}.{extension}"
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "no-store",
+        # Let reverse proxies pass chunks through instead of buffering the whole export
+        "X-Accel-Buffering": "no",
+    })
+
+
+# --- Prediction history export ---
+@export_bp.route('/predictions', methods=['GET'])
+@jwt_required()
+def export_predictions():
+    options, error = _export_options()
+    if error:
+        return error
+    export_format, compress, user = options
+    _ensure_indexes()
+
+    # _id order follows insertion, uses the default index, and never needs an in-memory sort
+    cursor = database.predictions.find(
+        {"user_id": user}, {field: 1 for field in PREDICTION_FIELDS if field != "id"}
+    ).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    return _streamed(cursor, PREDICTION_FIELDS, "predictions", export_format, compress, user)
+
+
+# --- Chatbot history export ---
+@export_bp.route('/chats', methods=['GET'])
+@jwt_required()
+def export_chats():
+    options, error = _export_options()
+    if error:
+        return error
+    export_format, compress, user = options
+    _ensure_indexes()
+
+    cursor = database.chats.find(
+        {"userId": user}, {field: 1 for field in CHAT_FIELDS if field != "id"}
+    ).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    return _streamed(cursor, CHAT_FIELDS, "chats", export_format, compress, user)
@@ -1,20 +1,40 @@
 # routes/predict.py
+import io
 import os
 import datetime
-from flask import Blueprint, request, jsonify
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, current_app, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 
 # ✅ Absolute imports (BACKEND is the top-level package)
-from model_loader import make_prediction
+from model_loader import make_prediction, make_tta_prediction, MAX_TTA_AUGMENTATIONS, registry
 from validator_loader import is_mri_scan
-from extensions import mongo
+from db import database
+from auth_cache import user_cache
+from gradcam import get_explanation, get_cached_explanation, image_hash
+from upload_guard import check_upload, UploadRejected, MAX_UPLOAD_BYTES
+from embedding_index import index as embedding_index
+from analytics import record_prediction
+from admission import inference_admission, Overloaded
+from memprofile import memory_profiled, admitted as profile_admitted, stage as profile_stage
 
 predict_bp = Blueprint("predict", __name__)
 
+UPLOAD_DIR = "uploads"
+
 @predict_bp.route("/upload", methods=["POST"])
 @jwt_required()
+@memory_profiled("upload")
 def upload_file():
+    # Refuse oversized bodies from the header alone, before the form is parsed. The body
+    # includes the multipart envelope, so it is held to MAX_CONTENT_LENGTH; the file itself
+    # is held to MAX_UPLOAD_BYTES by check_upload.
+    max_body = current_app.config.get("MAX_CONTENT_LENGTH")
+    if max_body and request.content_length and request.content_length > max_body:
+        return jsonify({"msg": f"File too large. The limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."}), 413
+
     if "mriScan" not in request.files:
         return jsonify({"msg": "No file part"}), 400
     
@@ -22,19 +42,48 @@ def upload_file():
     if file.filename == "":
         return jsonify({"msg": "No selected file"}), 400
 
+    # Check type and dimensions from the image header before anything is decoded
+    try:
+        check_upload(file.stream)
+    except UploadRejected as e:
+        return jsonify({"msg": e.msg}), e.status
+
+    # Optional test-time augmentation: number of views scored in one batch
+    try:
+        tta = int(request.form.get("tta") or request.args.get("tta") or 0)
+    except ValueError:
+        return jsonify({"msg": "tta must be a whole number"}), 400
+    if not 0 <= tta <= MAX_TTA_AUGMENTATIONS:
+        return jsonify({"msg": f"tta must be between 0 and {MAX_TTA_AUGMENTATIONS}"}), 400
+
     # Read the file's bytes
-    image_bytes = file.read()
+    with profile_stage("read"):
+        image_bytes = file.read()
 
     try:
-        # Validate MRI scan
-        is_valid_mri, confidence = is_mri_scan(image_bytes)
-        if not is_valid_mri:
-            return jsonify({
-                "msg": f"Validation Error: Not a valid spinal cord MRI scan. Confidence: {confidence:.2f}%"
-            }), 400
+        # Validation and inference share a bounded, per-user fair slot queue; a request
+        # sampled for memory profiling is measured from the moment it holds a slot
+        with inference_admission.slot(get_jwt_identity()), profile_admitted():
+            # Validate MRI scan
+            with profile_stage("validate"):
+                is_valid_mri, confidence = is_mri_scan(image_bytes)
+            if not is_valid_mri:
+                return jsonify({
+                    "msg": f"Validation Error: Not a valid spinal cord MRI scan. Confidence: {confidence:.2f}%"
+                }), 400
         
-        # Make prediction
-        prediction_label, prediction_confidence = make_prediction(image_bytes)
+            # Make prediction; the version is pinned so the record names the model that scored it
+            loaded = registry.active()
+            with profile_stage("predict"):
+                if tta > 1:
+                    prediction_label, prediction_confidence, prediction_spread, embedding = make_tta_prediction(
+                        image_bytes, tta, return_embedding=True, loaded=loaded
+                    )
+                else:
+                    prediction_label, prediction_confidence, embedding = make_prediction(
+                        image_bytes, return_embedding=True, loaded=loaded
+                    )
+
         result = "Tumor Detected" if prediction_label == 1 else "No Tumor"
         confidence_percent = f"{prediction_confidence * 100:.2f}%"
         
@@ -42,32 +91,182 @@ def upload_file():
             "result": result,
             "confidence": confidence_percent
         }
+        if tta > 1:
+            # Mean probability over the augmented views, and how much they disagree
+            prediction_result["confidence_spread"] = f"{prediction_spread * 100:.2f}%"
+            prediction_result["augmentations"] = tta
         
-        # Save uploaded file
+        # Save uploaded file under its content hash; the original name is kept for display
+        # only, since different users upload different scans under the same name
         filename = secure_filename(file.filename)
-        save_dir = "uploads"
-        os.makedirs(save_dir, exist_ok=True)
-        file_path = os.path.join(save_dir, filename)
-        with open(file_path, "wb") as f:
-            f.write(image_bytes)
+        digest = image_hash(image_bytes)
+        stored_file = digest + os.path.splitext(filename)[1].lower()
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        file_path = os.path.join(UPLOAD_DIR, stored_file)
+        with profile_stage("save"):
+            if not os.path.exists(file_path):
+                tmp_path = f"{file_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(image_bytes)
+                os.replace(tmp_path, file_path)
 
         # Save prediction to MongoDB
         user_id = get_jwt_identity()
+        user = user_cache.get(user_id) or {}
         prediction_data = {
             "user_id": user_id,
             "filename": filename,
+            "stored_file": stored_file,
             "result": prediction_result["result"],
             "confidence": prediction_result["confidence"],
+            "image_hash": digest,
+            "model_version": loaded.version,
             "date": datetime.datetime.now()
         }
-        mongo.db.predictions.insert_one(prediction_data)
+        if tta > 1:
+            prediction_data["confidence_spread"] = prediction_result["confidence_spread"]
+            prediction_data["augmentations"] = tta
+        if user.get("organization"):
+            prediction_data["organization"] = user["organization"]
+        database.predictions.insert_one(prediction_data)
+        prediction_data["id"] = str(prediction_data.pop("_id"))
+
+        # Count it in the hourly/daily rollups behind the admin analytics API
+        try:
+            record_prediction(database, prediction_data)
+        except Exception as e:
+            print(f"Error updating analytics rollups: {e}")
+
+        # Keep the scan's feature vector for "similar previous cases" search
+        try:
+            embedding_index.add(embedding, prediction_data["id"], user_id, user.get("organization"))
+        except Exception as e:
+            print(f"Error indexing prediction embedding: {e}")
 
         return jsonify({"prediction": prediction_result, "record": prediction_data}), 200
 
+    except Overloaded as e:
+        return jsonify({"msg": e.msg}), 503, {"Retry-After": str(e.retry_after)}
+
     except Exception as e:
         print(f"Error during prediction: {e}")
         return jsonify({"msg": f"An error occurred on the server: {e}"}), 500
 
+# --- Grad-CAM explanation endpoint ---
+@predict_bp.route("/explain/<prediction_id>", methods=["GET"])
+@jwt_required()
+def explain(prediction_id):
+    try:
+        prediction = database.predictions.find_one(
+            {"_id": ObjectId(prediction_id), "user_id": get_jwt_identity()},
+            {"filename": 1, "stored_file": 1, "image_hash": 1}
+        )
+    except InvalidId:
+        return jsonify({"msg": "Invalid prediction id"}), 400
+    if not prediction:
+        return jsonify({"msg": "Prediction not found"}), 404
+    # Without the hash there is no way to tell this scan from a later upload of the same name
+    if not prediction.get("image_hash"):
+        return jsonify({"msg": "Original scan is no longer available"}), 404
+
+    try:
+        # Repeat views are served straight from the cache without touching the scan.
+        png_bytes = get_cached_explanation(prediction["image_hash"])
+
+        if png_bytes is None:
+            # Older records were saved under the uploaded name, which later uploads overwrite
+            file_path = os.path.join(UPLOAD_DIR, prediction.get("stored_file") or prediction["filename"])
+            if not os.path.exists(file_path):
+                return jsonify({"msg": "Original scan is no longer available"}), 404
+            with open(file_path, "rb") as f:
+                image_bytes = f.read()
+            if image_hash(image_bytes) != prediction["image_hash"]:
+                return jsonify({"msg": "Original scan is no longer available"}), 404
+            # A forward and backward pass through the model; it queues with the uploads
+            with inference_admission.slot(get_jwt_identity()):
+                png_bytes = get_explanation(image_bytes, prediction["image_hash"])
+
+        response = send_file(io.BytesIO(png_bytes), mimetype="image/png")
+        response.headers["Cache-Control"] = "private, max-age=86400"
+        return response
+
+    except Overloaded as e:
+        return jsonify({"msg": e.msg}), 503, {"Retry-After": str(e.retry_after)}
+
+    except Exception as e:
+        print(f"Error generating explanation: {e}")
+        return jsonify({"msg": "An error occurred generating the explanation"}), 500
+
+# --- Similar previous cases ---
+@predict_bp.route("/similar/<prediction_id>", methods=["GET"])
+@jwt_required()
+def similar(prediction_id):
+    user_id = get_jwt_identity()
+    scope = request.args.get("scope", "user")
+    if scope not in ("user", "organization"):
+        return jsonify({"msg": "scope must be 'user' or 'organization'"}), 400
+    try:
+        k = max(1, min(int(request.args.get("k", 5)), 50))
+    except ValueError:
+        return jsonify({"msg": "k must be a whole number"}), 400
+
+    try:
+        prediction = database.predictions.find_one(
+            {"_id": ObjectId(prediction_id), "user_id": user_id}, {"organization": 1}
+        )
+    except InvalidId:
+        return jsonify({"msg": "Invalid prediction id"}), 400
+    if not prediction:
+        return jsonify({"msg": "Prediction not found"}), 404
+
+    organization = prediction.get("organization")
+    if scope == "organization" and not organization:
+        return jsonify({"msg": "Your account is not part of an organization"}), 400
+
+    try:
+        query = embedding_index.get_vector(prediction_id)
+        if query is None:
+            return jsonify({"msg": "This prediction has no stored embedding"}), 404
+
+        # Scoring the index is CPU-bound too, so it shares the inference slots
+        with inference_admission.slot(user_id):
+            matches = embedding_index.search(
+                query, k,
+                user_id=user_id if scope == "user" else None,
+                organization=organization if scope == "organization" else None,
+                exclude_prediction_id=prediction_id,
+            )
+        records = {
+            str(doc["_id"]): doc for doc in database.predictions.find(
+                {"_id": {"$in": [ObjectId(match_id) for match_id, _ in matches]}},
+                {"filename": 1, "result": 1, "confidence": 1, "date": 1, "user_id": 1}
+            )
+        }
+
+        similar_cases = []
+        for match_id, score in matches:
+            doc = records.get(match_id)
+            if not doc:
+                continue
+            similar_cases.append({
+                "id": match_id,
+                "similarity": round(score, 4),
+                "filename": doc.get("filename"),
+                "result": doc.get("result"),
+                "confidence": doc.get("confidence"),
+                "date": doc["date"].strftime("%Y-%m-%d %H:%M:%S") if doc.get("date") else None,
+                "own_scan": doc.get("user_id") == user_id,
+            })
+
+        return jsonify({"scope": scope, "similar": similar_cases}), 200
+
+    except Overloaded as e:
+        return jsonify({"msg": e.msg}), 503, {"Retry-After": str(e.retry_after)}
+
+    except Exception as e:
+        print(f"Error searching similar cases: {e}")
+        return jsonify({"msg": "An error occurred searching similar cases"}), 500
+
 # --- Stats endpoint ---
 @predict_bp.route("/stats", methods=["GET"])
 @jwt_required()
@@ -76,13 +275,13 @@ def stats():
         user_id = get_jwt_identity()
 
         # Recent predictions
-        recent_predictions = list(mongo.db.predictions.find(
+        recent_predictions = list(database.predictions.find(
             {"user_id": user_id},
             {"_id": 0}
         ).sort("date", -1).limit(20))
 
         # Totals
-        total_counts = mongo.db.predictions.aggregate([
+        total_counts = database.predictions.aggregate([
             {"$match": {"user_id": user_id}},
             {"$group": {"_id": "$result", "count": {"$sum": 1}}}
         ])
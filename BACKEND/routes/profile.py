@@ -6,7 +6,8 @@ from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required
 
 # ✅ Use absolute import for Render deployment
-from extensions import mongo
+from db import database
+from auth_cache import user_cache
 
 profile_bp = Blueprint('profile', __name__)
 
@@ -21,7 +22,7 @@ def allowed_file(filename):
 @jwt_required()
 def get_user_profile(email):
     try:
-        user_data = mongo.db.users.find_one({'email': email})
+        user_data = user_cache.get(email)
         if user_data:
             profile_info = {
                 'name': user_data.get('name'),
@@ -62,10 +63,11 @@ def upload_profile_photo():
         
         file.save(os.path.join(upload_path, unique_filename))
         
-        mongo.db.users.update_one(
+        database.users.update_one(
             {'email': user_email},
             {'$set': {'profilePhoto': unique_filename}}
         )
+        user_cache.invalidate(user_email)
 
         photo_url = url_for(
             'static',
@@ -88,11 +90,12 @@ def update_profile():
     if not current_email or not new_name:
         return jsonify({'error': 'Missing data for update'}), 400
 
-    result = mongo.db.users.update_one(
+    result = database.users.update_one(
         {'email': current_email},
         {'$set': {'name': new_name}}
     )
 
+    user_cache.invalidate(current_email)
     if result.matched_count:
         return jsonify({'success': True, 'msg': 'Profile updated successfully'}), 200
     else:
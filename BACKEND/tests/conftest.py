@@ -0,0 +1,73 @@
+# BACKEND/tests/conftest.py
+"""
+Request-level tests against loadtest.create_standin_app(): mongomock instead
+of Atlas, a fake Gemini, and DenseNet121 with seeded random weights.
+
+    pip install pytest mongomock
+    python -m pytest -q BACKEND/tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='spinal-tests-')
+ADMIN_EMAIL = 'admin@example.com'
+
+# Read at import time by config, permissions, model_loader and embedding_index
+os.environ.pop('LOADTEST_MONGO_URI', None)
+os.environ.update({
+    'JWT_SECRET_KEY': 'test-jwt-secret-key-0123456789abcdef',
+    'ADMIN_EMAILS': ADMIN_EMAIL,
+    'MODEL_PATH': os.path.join(WORKDIR, 'random_weights.pth'),
+    'MODEL_DIR': os.path.join(WORKDIR, 'model_versions'),
+    'MODEL_PRELOAD': '0',
+    'MODEL_TORCHSCRIPT': '0',
+    'MODEL_WARMUP_BATCH_SIZES': '1',
+    'EMBEDDING_INDEX_DIR': os.path.join(WORKDIR, 'embedding_index'),
+    'LOADTEST_USERS': '1',
+    'LOADTEST_GEMINI_LATENCY_MS': '0',
+    'LOADTEST_GEMINI_JITTER_MS': '0',
+})
+# Uploads, Grad-CAM overlays and the memprofile control file are relative to the cwd
+os.chdir(WORKDIR)
+sys.path.insert(0, BACKEND_DIR)
+
+pytest.importorskip('mongomock')
+import loadtest  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    loadtest._write_random_weights(os.environ['MODEL_PATH'])
+    app = loadtest.create_standin_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def database(app):
+    from db import database
+    return database
+
+
+@pytest.fixture
+def headers_for(app, database):
+    """Returns Authorization headers for `identity`, creating the user (by email) if needed."""
+    from flask_jwt_extended import create_access_token
+
+    def headers_for(identity, email=None):
+        email = email or identity
+        database.users.update_one(
+            {'email': email}, {'$setOnInsert': {'name': email.split('@')[0], 'email': email}}, upsert=True
+        )
+        with app.app_context():
+            return {'Authorization': f'Bearer {create_access_token(identity=str(identity))}'}
+    return headers_for
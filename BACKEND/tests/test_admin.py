@@ -0,0 +1,18 @@
+# BACKEND/tests/test_admin.py
+from conftest import ADMIN_EMAIL
+
+
+def test_model_registry_is_admin_only(client, headers_for):
+    assert client.get('/api/admin/models', headers=headers_for('clinician@example.com')).status_code == 403
+
+    response = client.get('/api/admin/models', headers=headers_for(ADMIN_EMAIL))
+    assert response.status_code == 200
+    assert 'random_weights' in response.json["available"]
+
+
+def test_admin_with_object_id_identity(client, database, headers_for):
+    # app.py issues tokens for the account's ObjectId rather than its email
+    headers_for(ADMIN_EMAIL)
+    admin_id = database.users.find_one({"email": ADMIN_EMAIL})["_id"]
+    response = client.get('/api/admin/admission', headers=headers_for(admin_id, email=ADMIN_EMAIL))
+    assert response.status_code == 200
@@ -0,0 +1,20 @@
+# BACKEND/tests/test_analytics.py
+import datetime
+
+from analytics import record_predictions
+from conftest import ADMIN_EMAIL
+
+
+def test_summary_reads_the_rollups(client, database, headers_for):
+    now = datetime.datetime.now()
+    record_predictions(database, [
+        {"date": now, "result": "Tumor Detected", "confidence": "91.00%", "organization": "analytics-clinic"},
+        {"date": now, "result": "No Tumor", "confidence": "12.00%", "organization": "analytics-clinic"},
+    ])
+
+    url = '/api/analytics/summary?granularity=hour&organization=analytics-clinic'
+    assert client.get(url, headers=headers_for('clinician@example.com')).status_code == 403
+    response = client.get(url, headers=headers_for(ADMIN_EMAIL))
+    assert response.status_code == 200
+    assert response.json["totals"]["uploads"] == 2
+    assert response.json["totals"]["tumor_rate"] == 0.5
@@ -0,0 +1,22 @@
+# BACKEND/tests/test_auth.py
+from werkzeug.security import generate_password_hash
+
+
+def test_password_change_revokes_tokens_of_both_identity_forms(client, database, headers_for):
+    email = 'rotate@example.com'
+    user_id = database.users.insert_one({
+        "name": "Rotate", "email": email, "password": generate_password_hash("old-password", method='pbkdf2:sha256'),
+    }).inserted_id
+    email_headers = headers_for(email)
+    # The identity app.py puts in its tokens
+    object_id_headers = headers_for(user_id, email=email)
+    assert client.get('/api/predict/stats', headers=object_id_headers).status_code == 200
+
+    response = client.post('/api/auth/change-password', headers=object_id_headers,
+                           json={"currentPassword": "old-password", "newPassword": "new-password"})
+    assert response.status_code == 200
+
+    assert client.get('/api/predict/stats', headers=object_id_headers).status_code == 401
+    assert client.get('/api/predict/stats', headers=email_headers).status_code == 401
+    new_headers = {'Authorization': f'Bearer {response.json["token"]}'}
+    assert client.get('/api/predict/stats', headers=new_headers).status_code == 200
@@ -0,0 +1,45 @@
+# BACKEND/tests/test_bulk_score.py
+import datetime
+
+import numpy as np
+
+import bulk_score
+from analytics import read_rollups
+
+
+def _rows(count):
+    return [{
+        "path": f"/archive/scan-{i}.png",
+        "filename": f"scan-{i}.png",
+        "image_hash": f"{i:064x}",
+        "result": "Tumor Detected",
+        "confidence": "90.00%",
+        "model_version": "test",
+    } for i in range(count)]
+
+
+def test_rescored_paths_appear_once_in_similar_cases(client, database, headers_for):
+    email = 'rescore@example.com'
+    headers = headers_for(email)
+    rows = _rows(3)
+    rng = np.random.default_rng(0)
+    # The second run re-scores the same paths, indexing each prediction again
+    for _ in range(2):
+        bulk_score.upsert_predictions(
+            database.predictions, rows, email, rng.normal(size=(len(rows), 1024)).astype(np.float32)
+        )
+
+    ids = [str(doc["_id"]) for doc in database.predictions.find({"user_id": email})]
+    assert len(ids) == len(rows)
+    response = client.get(f'/api/predict/similar/{ids[0]}?k=10', headers=headers)
+    assert response.status_code == 200
+    returned = [case["id"] for case in response.json["similar"]]
+    assert sorted(returned) == sorted(ids[1:])
+
+
+def test_bulk_rows_count_towards_their_organization(database):
+    hour = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    bulk_score.upsert_predictions(database.predictions, _rows(2), 'clinic@example.com', organization='clinic-a')
+
+    series = read_rollups(database, 'hour', hour, hour + datetime.timedelta(hours=1), 'clinic-a')
+    assert sum(item["uploads"] for item in series) == 2
@@ -0,0 +1,55 @@
+# BACKEND/tests/test_export.py
+import csv
+import datetime
+import io
+import json
+import os
+
+from conftest import ADMIN_EMAIL, BACKEND_DIR
+
+
+def _csv(response):
+    return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_prediction_export_is_scoped_to_the_caller(client, database, headers_for):
+    database.predictions.insert_many([
+        {"user_id": "exporter@example.com", "filename": f"scan-{i}.png", "result": "No Tumor",
+         "confidence": "20.00%", "date": datetime.datetime(2026, 1, 1, 9, i)}
+        for i in range(3)
+    ] + [{"user_id": "someone-else@example.com", "filename": "other.png", "result": "No Tumor"}])
+
+    response = client.get('/api/export/predictions', headers=headers_for('exporter@example.com'))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert [row["filename"] for row in _csv(response)] == ["scan-0.png", "scan-1.png", "scan-2.png"]
+
+    url = '/api/export/predictions?user=someone-else@example.com'
+    assert client.get(url, headers=headers_for('exporter@example.com')).status_code == 403
+    assert [row["filename"] for row in _csv(client.get(url, headers=headers_for(ADMIN_EMAIL)))] == ["other.png"]
+
+
+def test_uploaded_predictions_export_their_model_version(client, headers_for):
+    headers = headers_for('uploader@example.com')
+    with open(os.path.join(BACKEND_DIR, 'validator_data', 'train', 'mri', '1.jpg'), 'rb') as f:
+        response = client.post('/api/predict/upload', headers=headers, data={'mriScan': (f, '1.jpg')},
+                               content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.json["record"]["model_version"] == 'random_weights'
+
+    rows = _csv(client.get('/api/export/predictions', headers=headers))
+    assert [row["model_version"] for row in rows] == ['random_weights']
+
+
+def test_chat_export_neutralizes_spreadsheet_formulas(client, database, headers_for):
+    database.chats.insert_one({
+        "userId": "chatter@example.com", "question": "=HYPERLINK(\"http://example.com\")",
+        "answer": "-2+3", "timestamp": datetime.datetime(2026, 1, 1),
+    })
+
+    rows = _csv(client.get('/api/export/chats', headers=headers_for('chatter@example.com')))
+    assert rows[0]["question"] == "'=HYPERLINK(\"http://example.com\")"
+    assert rows[0]["answer"] == "'-2+3"
+
+    response = client.get('/api/export/chats?format=ndjson', headers=headers_for('chatter@example.com'))
+    assert json.loads(response.get_data(as_text=True))["answer"] == "-2+3"
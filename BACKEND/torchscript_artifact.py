@@ -0,0 +1,210 @@
+# BACKEND/torchscript_artifact.py
+"""
+Frozen TorchScript artifacts of the serving model, to cut worker cold starts.
+
+    python torchscript_artifact.py build                # every version in the registry
+    python torchscript_artifact.py build --version v2
+    python torchscript_artifact.py benchmark            # first-request latency, eager vs artifact
+
+An artifact is the DenseNet traced end to end (features -> pooled embedding
+-> classifier) and frozen (conv/batch-norm folding, constant propagation), so
+a worker loads one file instead of building the torchvision model in Python
+and loading the state dict into it. Artifacts are keyed on the weights hash,
+the torch version and the device type; model_loader serves from a matching
+artifact and falls back to the eager model when there is none. Build them as
+part of the deploy, after the weights and before starting gunicorn.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model_registry import MODEL_DIR
+
+ARTIFACT_DIR = os.getenv('TORCHSCRIPT_DIR', os.path.join(MODEL_DIR, 'torchscript'))
+# Set MODEL_TORCHSCRIPT=0 to always serve the eager model
+USE_ARTIFACTS = os.getenv('MODEL_TORCHSCRIPT', '1') != '0'
+# optimize_for_inference converts convolutions to oneDNN's blocked layout;
+# around every DenseNet concat that costs more than it saves on CPU (batch of
+# 8 measured ~30% slower than the plain frozen graph), so it is opt-in.
+OPTIMIZE_FOR_INFERENCE = os.getenv('TORCHSCRIPT_OPTIMIZE_FOR_INFERENCE', '0') == '1'
+# Largest difference from the eager outputs a freshly built artifact may show
+TOLERANCE = 1e-4
+
+
+def artifact_path(weights_hash, device):
+    torch_version = torch.__version__.replace('+', '_')
+    return os.path.join(ARTIFACT_DIR, f"{weights_hash}-torch{torch_version}-{device.type}.pt")
+
+
+class _ScoringNetwork(nn.Module):
+    """model_loader.forward_with_embedding as a single traceable forward."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.features = model.features
+        self.classifier = model.classifier
+
+    def forward(self, image_tensor):
+        features = F.relu(self.features(image_tensor))
+        embeddings = F.adaptive_avg_pool2d(features, (1, 1)).flatten(1)
+        return self.classifier(embeddings), embeddings
+
+
+class FrozenModel:
+    """
+    A loaded artifact behind the eager model's interface: calling it returns
+    the (N, 1) probabilities, with_embedding() the pooled features as well.
+    """
+    serving_mode = 'torchscript'
+
+    def __init__(self, module):
+        self.module = module
+
+    def __call__(self, image_tensor):
+        return self.module(image_tensor)[0]
+
+    def with_embedding(self, image_tensor):
+        probabilities, embeddings = self.module(image_tensor)
+        return probabilities.view(-1), embeddings
+
+
+def _load_module(path, device):
+    extra_files = {'meta.json': ''}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    if OPTIMIZE_FOR_INFERENCE:
+        # The pass prepacks weights into constants that can't be serialized,
+        # so it runs on load rather than at build time
+        module = torch.jit.optimize_for_inference(module)
+    return module, json.loads(extra_files['meta.json'] or '{}')
+
+
+def build(model, weights_hash, device):
+    """
+    Traces and freezes an eager model in eval mode, checks the artifact
+    against the eager outputs, and moves it into place. Returns the path.
+    """
+    network = _ScoringNetwork(model).eval()
+    example = torch.rand(2, 3, 224, 224, device=device) * 2 - 1
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.trace(network, example))
+
+    path = artifact_path(weights_hash, device)
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    meta = {"weights_hash": weights_hash, "torch_version": torch.__version__, "device": device.type}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.jit.save(frozen, tmp_path, _extra_files={'meta.json': json.dumps(meta)})
+    try:
+        # Check exactly what a worker will run, on a batch size the trace didn't see
+        loaded, _ = _load_module(tmp_path, device)
+        check = torch.rand(3, 3, 224, 224, device=device) * 2 - 1
+        with torch.no_grad():
+            error = max((a - e).abs().max().item() for a, e in zip(loaded(check), network(check)))
+        if error > TOLERANCE:
+            raise RuntimeError(f"Frozen model differs from the eager model by {error:.2e}")
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return path
+
+
+def load(weights_hash, device):
+    """Returns a FrozenModel for these weights, or None if no artifact was built for them."""
+    path = artifact_path(weights_hash, device)
+    if not USE_ARTIFACTS or not os.path.exists(path):
+        return None
+    module, meta = _load_module(path, device)
+    if meta.get('weights_hash') != weights_hash or meta.get('torch_version') != torch.__version__:
+        raise ValueError(f"{path} was built for {meta}, not weights {weights_hash} on torch {torch.__version__}")
+    return FrozenModel(module)
+
+
+# --- CLI ---
+def _build(model_loader, versions):
+    available = model_loader.registry.available_versions()
+    for version in versions or sorted(available):
+        if version not in available:
+            raise SystemExit(f"Unknown model version: {version}")
+        weights_hash = model_loader.get_weights_version(available[version])
+        started = time.perf_counter()
+        path = build(model_loader.load_model(available[version]), weights_hash, model_loader.device)
+        print(f"✅ Built {path} for version '{version}' in {time.perf_counter() - started:.1f}s")
+
+
+def _probe(model_loader, version, mode):
+    """Times a cold start in this (fresh) process; prints one JSON line."""
+    path = model_loader.registry.available_versions()[version]
+    weights_hash = model_loader.get_weights_version(path)
+    image_tensor = torch.rand(1, 3, 224, 224, device=model_loader.device) * 2 - 1
+
+    started = time.perf_counter()
+    model = load(weights_hash, model_loader.device) if mode == 'torchscript' else model_loader.load_model(path)
+    if model is None:
+        raise SystemExit(f"No TorchScript artifact for version '{version}'; run the build command first")
+    load_seconds = time.perf_counter() - started
+
+    def first_request():
+        started = time.perf_counter()
+        model_loader.forward_with_embedding(model, image_tensor)
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    cold_ms = first_request()
+    started = time.perf_counter()
+    model_loader.warmup_model(model)
+    warmup_seconds = time.perf_counter() - started
+    print(json.dumps({
+        "mode": mode,
+        "load_seconds": round(load_seconds, 3),
+        "first_request_ms_without_warmup": cold_ms,
+        "warmup_seconds": round(warmup_seconds, 3),
+        "first_request_ms_after_warmup": first_request(),
+    }))
+
+
+def _benchmark(version):
+    env = dict(os.environ, MODEL_PRELOAD='0')
+    for mode in ('eager', 'torchscript'):
+        # A fresh interpreter per mode, so neither run inherits the other's warm kernels
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), 'probe', '--mode', mode, '--version', version],
+            env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            print(f"❌ {mode}: {(result.stderr or result.stdout).strip().splitlines()[-1]}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:>11}: load {stats['load_seconds']:.2f}s, "
+              f"first request {stats['first_request_ms_without_warmup']:.0f} ms without warmup / "
+              f"{stats['first_request_ms_after_warmup']:.0f} ms after {stats['warmup_seconds']:.1f}s warmup")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="Build artifacts for the weights in the registry")
+    build_parser.add_argument('--version', action='append', help="Only this version (repeatable)")
+    benchmark_parser = sub.add_parser('benchmark', help="Compare cold-start latency of the eager model and the artifact")
+    benchmark_parser.add_argument('--version', help="Version to time (default: the bundled model)")
+    probe_parser = sub.add_parser('probe', help="Time one cold start in this process (used by benchmark)")
+    probe_parser.add_argument('--mode', choices=('eager', 'torchscript'), required=True)
+    probe_parser.add_argument('--version', required=True)
+    args = parser.parse_args()
+
+    # Only the definitions are needed; loading is done explicitly above
+    os.environ['MODEL_PRELOAD'] = '0'
+    import model_loader
+
+    default_version = os.path.splitext(os.path.basename(model_loader.MODEL_PATH))[0]
+    if args.command == 'build':
+        _build(model_loader, args.version)
+    elif args.command == 'benchmark':
+        _benchmark(args.version or default_version)
+    else:
+        _probe(model_loader, args.version, args.mode)
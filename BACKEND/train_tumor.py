@@ -0,0 +1,311 @@
+"""
+Data-parallel training for the DenseNet121 spinal tumor model.
+
+Uses the exact architecture and preprocessing that model_loader serves with,
+and runs one DistributedDataParallel process per CPU share (gloo backend).
+
+    python train_tumor.py --data-dir tumor_data --nprocs 4 --epochs 10
+    python train_tumor.py --data-dir tumor_data --nprocs 4 --resume
+    python train_tumor.py --data-dir tumor_data --scaling 1,2,4 --benchmark-steps 20
+
+The data folder is laid out for torchvision's ImageFolder:
+
+    tumor_data/train/<class>/*.jpg     tumor_data/val/<class>/*.jpg
+
+and --positive-class names the folder holding tumor scans (label 1).
+Checkpoints are written atomically every --checkpoint-every optimizer steps
+and at the end of every epoch; --resume continues from the exact step,
+including mid-epoch. The final weights are saved as a plain state_dict in
+MODEL_DIR so they can be activated through the model registry.
+"""
+import argparse
+import datetime
+import itertools
+import os
+import socket
+import time
+from contextlib import nullcontext
+
+# Only the architecture and transform are needed; don't load serving weights.
+os.environ.setdefault('MODEL_PRELOAD', '0')
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset, Sampler
+from torch.utils.data.distributed import DistributedSampler
+from torchvision import datasets
+
+from model_loader import get_model_architecture, get_image_transform
+from model_registry import MODEL_DIR
+
+
+class SyntheticScans(Dataset):
+    """Random tensors shaped like preprocessed scans, for --synthetic benchmark runs."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        generator = torch.Generator().manual_seed(index)
+        return torch.randn(3, 224, 224, generator=generator), index % 2
+
+
+class BinaryTarget:
+    """Maps ImageFolder class indices to 1 for the tumor class and 0 otherwise."""
+
+    def __init__(self, positive_index):
+        self.positive_index = positive_index
+
+    def __call__(self, label):
+        return int(label == self.positive_index)
+
+
+class SkipSampler(Sampler):
+    """Skips the first `skip` indices of a sampler, to resume partway through an epoch."""
+
+    def __init__(self, sampler, skip):
+        self.sampler = sampler
+        self.skip = skip
+
+    def __iter__(self):
+        return itertools.islice(iter(self.sampler), self.skip, None)
+
+    def __len__(self):
+        return max(0, len(self.sampler) - self.skip)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def load_datasets(args):
+    if args.synthetic:
+        return SyntheticScans(args.synthetic), SyntheticScans(max(1, args.synthetic // 10))
+
+    transform = get_image_transform()
+    train_set = datasets.ImageFolder(os.path.join(args.data_dir, 'train'), transform)
+    val_set = datasets.ImageFolder(os.path.join(args.data_dir, 'val'), transform)
+    if args.positive_class not in train_set.class_to_idx:
+        raise SystemExit(f"--positive-class '{args.positive_class}' not in {train_set.classes}")
+    train_set.target_transform = BinaryTarget(train_set.class_to_idx[args.positive_class])
+    val_set.target_transform = BinaryTarget(val_set.class_to_idx.get(args.positive_class, -1))
+    return train_set, val_set
+
+
+def build_model(args):
+    model = get_model_architecture()
+    if args.init_from:
+        model.load_state_dict(torch.load(args.init_from, map_location='cpu'))
+    return model
+
+
+def save_checkpoint(path, state):
+    """Writes the checkpoint next to its final name and renames it into place."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def evaluate(model, loader, criterion):
+    model.eval()
+    totals = torch.zeros(3, dtype=torch.float64)  # loss sum, correct, count
+    with torch.no_grad():
+        for inputs, labels in loader:
+            labels = labels.float().view(-1, 1)
+            outputs = model(inputs)
+            totals[0] += criterion(outputs, labels).item() * inputs.size(0)
+            totals[1] += ((outputs > 0.5).float() == labels).sum().item()
+            totals[2] += inputs.size(0)
+    dist.all_reduce(totals)
+    model.train()
+    return totals[0].item() / max(totals[2].item(), 1), totals[1].item() / max(totals[2].item(), 1)
+
+
+def train_worker(rank, world_size, port, args, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    # Split the machine's cores between the processes instead of oversubscribing them
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // world_size))
+    torch.manual_seed(args.seed)
+    is_main = rank == 0
+
+    train_set, val_set = load_datasets(args)
+    model = DistributedDataParallel(build_model(args))
+    criterion = nn.BCELoss()  # the classifier already ends in a Sigmoid
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+
+    epoch, step_in_epoch, global_step = 0, 0, 0
+    if args.resume and os.path.exists(args.checkpoint):
+        state = torch.load(args.checkpoint, map_location='cpu')
+        model.module.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        epoch, step_in_epoch, global_step = state['epoch'], state['step_in_epoch'], state['global_step']
+        if state['world_size'] != world_size and step_in_epoch:
+            # Shards differ with the process count, so mid-epoch positions don't carry over.
+            step_in_epoch = 0
+        if is_main:
+            print(f"✅ Resumed from {args.checkpoint} at epoch {epoch + 1}, step {step_in_epoch}")
+
+    sampler = DistributedSampler(train_set, num_replicas=world_size, rank=rank, shuffle=True, seed=args.seed)
+    val_loader = DataLoader(
+        val_set, batch_size=args.batch_size, num_workers=args.workers,
+        sampler=DistributedSampler(val_set, num_replicas=world_size, rank=rank, shuffle=False),
+    )
+    # One optimizer step consumes accumulation_steps micro-batches on every process
+    global_batch = args.batch_size * args.accumulation_steps * world_size
+    if is_main:
+        print(f"Training on {len(train_set)} scans with {world_size} process(es), "
+              f"global batch {global_batch} ({args.batch_size} x {args.accumulation_steps} accumulation x {world_size})")
+
+    def checkpoint_state(epoch, step_in_epoch):
+        return {
+            'model': model.module.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'epoch': epoch,
+            'step_in_epoch': step_in_epoch,
+            'global_step': global_step,
+            'world_size': world_size,
+            'args': vars(args),
+        }
+
+    # Throughput is timed once this run's first warmup_steps optimizer steps are done
+    steps_run, timed_samples = 0, 0
+    timed_started = time.perf_counter() if args.warmup_steps == 0 else None
+    model.train()
+    while epoch < args.epochs:
+        sampler.set_epoch(epoch)
+        skip = step_in_epoch * args.accumulation_steps * args.batch_size
+        loader = DataLoader(train_set, batch_size=args.batch_size, num_workers=args.workers,
+                            sampler=SkipSampler(sampler, skip), drop_last=True)
+        micro_batches = iter(loader)
+        running_loss, running_count = 0.0, 0
+
+        while True:
+            batch = list(itertools.islice(micro_batches, args.accumulation_steps))
+            if len(batch) < args.accumulation_steps:
+                break  # an incomplete accumulation group is dropped, like drop_last
+
+            optimizer.zero_grad()
+            for i, (inputs, labels) in enumerate(batch):
+                labels = labels.float().view(-1, 1)
+                # Only the last micro-batch all-reduces gradients; the others just accumulate
+                sync = model.no_sync() if i < len(batch) - 1 else nullcontext()
+                with sync:
+                    loss = criterion(model(inputs), labels) / args.accumulation_steps
+                    loss.backward()
+                running_loss += loss.item() * args.accumulation_steps * inputs.size(0)
+                running_count += inputs.size(0)
+            optimizer.step()
+            step_in_epoch += 1
+            global_step += 1
+
+            steps_run += 1
+            if steps_run == args.warmup_steps:
+                timed_started = time.perf_counter()
+            elif steps_run > args.warmup_steps:
+                timed_samples += args.batch_size * args.accumulation_steps
+
+            if is_main and global_step % args.log_every == 0:
+                print(f"epoch {epoch + 1} step {step_in_epoch}  loss {running_loss / max(running_count, 1):.4f}")
+            if args.benchmark_steps and steps_run >= args.benchmark_steps:
+                break
+            if is_main and args.checkpoint_every and global_step % args.checkpoint_every == 0:
+                save_checkpoint(args.checkpoint, checkpoint_state(epoch, step_in_epoch))
+
+        if args.benchmark_steps:
+            break
+
+        val_loss, val_acc = evaluate(model, val_loader, criterion)
+        epoch, step_in_epoch = epoch + 1, 0
+        if is_main:
+            print(f"✅ Epoch {epoch}/{args.epochs}  train loss {running_loss / max(running_count, 1):.4f}  "
+                  f"val loss {val_loss:.4f}  val acc {val_acc:.4f}")
+            save_checkpoint(args.checkpoint, checkpoint_state(epoch, 0))
+
+    # Global throughput: all samples over the slowest process's timed window
+    elapsed = time.perf_counter() - timed_started if timed_started else 0.0
+    totals = torch.tensor([float(timed_samples), elapsed], dtype=torch.float64)
+    dist.all_reduce(totals[:1])
+    dist.all_reduce(totals[1:], op=dist.ReduceOp.MAX)
+    if is_main:
+        images_per_second = totals[0].item() / totals[1].item() if totals[1].item() else 0.0
+        results.put(images_per_second)
+        if not args.benchmark_steps:
+            os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+            torch.save(model.module.state_dict(), args.output)
+            print(f"✅ Saved weights to {args.output}")
+    dist.destroy_process_group()
+
+
+def run(world_size, args):
+    """Spawns world_size training processes and returns the measured images/s."""
+    results = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(train_worker, args=(world_size, _free_port(), args, results), nprocs=world_size, join=True)
+    return results.get() if not results.empty() else 0.0
+
+
+def scaling_curve(process_counts, args):
+    print(f"Measuring throughput for {process_counts} processes ({args.benchmark_steps} steps each)...")
+    rows = []
+    for world_size in process_counts:
+        rows.append((world_size, run(world_size, args)))
+        print(f"  {world_size} process(es): {rows[-1][1]:.1f} images/s")
+
+    baseline = rows[0][1] / rows[0][0] if rows[0][1] else 0.0
+    print("\nprocs  images/s  speedup  efficiency")
+    for world_size, images_per_second in rows:
+        speedup = images_per_second / rows[0][1] if rows[0][1] else 0.0
+        efficiency = images_per_second / (baseline * world_size) if baseline else 0.0
+        print(f"{world_size:>5}  {images_per_second:>8.1f}  {speedup:>6.2f}x  {efficiency:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default='tumor_data')
+    parser.add_argument('--positive-class', default='tumor', help="Folder name of the tumor class")
+    parser.add_argument('--synthetic', type=int, metavar='N', help="Use N random scans instead of --data-dir")
+    parser.add_argument('--nprocs', type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, help="Torch threads per process (default: cores / nprocs)")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=8, help="Micro-batch per process")
+    parser.add_argument('--accumulation-steps', type=int, default=4)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    parser.add_argument('--workers', type=int, default=1, help="DataLoader workers per process")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--init-from', help="Start from an existing weights file, e.g. densenet_spinal_tumor.pth")
+    parser.add_argument('--checkpoint', default=os.path.join('checkpoints', 'train_tumor.pt'))
+    parser.add_argument('--checkpoint-every', type=int, default=50, help="Optimizer steps between checkpoints")
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--output', help="Final weights (default: MODEL_DIR/trained-<timestamp>.pth)")
+    parser.add_argument('--log-every', type=int, default=10)
+    parser.add_argument('--warmup-steps', type=int, default=2, help="Steps excluded from the throughput timing")
+    parser.add_argument('--benchmark-steps', type=int, default=0, help="Stop after this many steps (no saving)")
+    parser.add_argument('--scaling', help="Comma-separated process counts to benchmark, e.g. 1,2,4")
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = os.path.join(MODEL_DIR, f"trained-{datetime.datetime.now():%Y%m%d-%H%M%S}.pth")
+
+    if args.scaling:
+        args.benchmark_steps = args.benchmark_steps or 20
+        args.resume = False
+        scaling_curve([int(n) for n in args.scaling.split(',')], args)
+        return
+
+    images_per_second = run(args.nprocs, args)
+    if images_per_second:
+        print(f"Throughput: {images_per_second:.1f} images/s with {args.nprocs} process(es)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# BACKEND/upload_guard.py
+import os
+import struct
+
+from PIL import Image
+
+# --- Admission limits for uploaded scans ---
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 25_000_000))
+MAX_IMAGE_SIDE = int(os.getenv('MAX_IMAGE_SIDE', 8192))
+
+# Formats Pillow decodes for us; everything else is refused up front.
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'GIF', 'BMP', 'WEBP'}
+
+# The header is read in growing chunks; JPEG dimensions can sit behind large
+# EXIF/ICC segments, so keep scanning up to HEADER_SCAN_LIMIT bytes.
+HEADER_CHUNK = 4096
+HEADER_SCAN_LIMIT = 512 * 1024
+
+# check_upload() is what enforces the pixel limit. Pillow's own bomb check only
+# warns above this value and refuses images over twice it, so it is a last
+# resort for files that never went through check_upload(), not a second limit.
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails admission; carries the HTTP status to return."""
+
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
+        self.msg = msg
+
+
+class _NeedMoreData(Exception):
+    pass
+
+
+def _sniff_format(head):
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if head.startswith(b'BM'):
+        return 'BMP'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def _unpack(fmt, data, offset):
+    end = offset + struct.calcsize(fmt)
+    if len(data) < end:
+        raise _NeedMoreData()
+    return struct.unpack(fmt, data[offset:end])
+
+
+def _png_size(head):
+    if _unpack('>4s', head, 12)[0] != b'IHDR':
+        raise UploadRejected(415, "Malformed PNG header")
+    return _unpack('>II', head, 16)
+
+
+def _gif_size(head):
+    return _unpack('<HH', head, 6)
+
+
+def _bmp_size(head):
+    header_size, = _unpack('<I', head, 14)
+    if header_size == 12:  # OS/2 BITMAPCOREHEADER
+        return _unpack('<HH', head, 18)
+    width, height = _unpack('<ii', head, 18)
+    return abs(width), abs(height)  # Negative height means a top-down bitmap
+
+
+def _webp_size(head):
+    chunk, = _unpack('4s', head, 12)
+    if chunk == b'VP8 ':
+        width, height = _unpack('<HH', head, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        b0, b1, b2, b3 = _unpack('4B', head, 21)
+        return 1 + (((b1 & 0x3F) << 8) | b0), 1 + (((b3 & 0xF) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+    if chunk == b'VP8X':
+        w0, w1, w2, h0, h1, h2 = _unpack('6B', head, 24)
+        return 1 + (w0 | w1 << 8 | w2 << 16), 1 + (h0 | h1 << 8 | h2 << 16)
+    raise UploadRejected(415, "Malformed WebP header")
+
+
+# Start-of-frame markers carry the dimensions; C4 (DHT), C8 (JPG) and CC (DAC) don't.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(head):
+    offset = 2
+    while True:
+        marker_start, marker = _unpack('BB', head, offset)
+        if marker_start != 0xFF:
+            raise UploadRejected(415, "Malformed JPEG header")
+        if marker == 0xFF:  # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # Markers without a length
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):  # End of image or start of scan before any frame header
+            raise UploadRejected(415, "JPEG has no frame header")
+        length, = _unpack('>H', head, offset + 2)
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = _unpack('>HH', head, offset + 5)
+            return width, height
+        offset += 2 + length
+
+
+_SIZE_READERS = {
+    'JPEG': _jpeg_size,
+    'PNG': _png_size,
+    'GIF': _gif_size,
+    'BMP': _bmp_size,
+    'WEBP': _webp_size,
+}
+
+
+def read_image_header(head):
+    """
+    Identifies the image format from its magic bytes and reads the dimensions
+    from the header alone. Returns (format, width, height), or None if `head`
+    is too short to tell yet.
+    """
+    if len(head) < 12:
+        return None
+    image_format = _sniff_format(head)
+    if image_format not in ALLOWED_FORMATS:
+        raise UploadRejected(415, "Unsupported file type. Please upload a JPEG, PNG, GIF, BMP or WebP image.")
+    try:
+        width, height = _SIZE_READERS[image_format](head)
+    except _NeedMoreData:
+        return None
+    return image_format, width, height
+
+
+def check_upload(stream):
+    """
+    Admits an uploaded file without decoding it: enforces the byte limit,
+    sniffs the format and checks the declared dimensions. The stream is
+    rewound afterwards so the caller can read it normally.
+    """
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadRejected(413, f"File too large. The limit is {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    if size == 0:
+        raise UploadRejected(400, "Uploaded file is empty")
+
+    head = b''
+    header = None
+    try:
+        while header is None:
+            # Double the read size each round so long headers stay linear to scan.
+            chunk = stream.read(max(HEADER_CHUNK, len(head)))
+            if not chunk:
+                break
+            head += chunk
+            header = read_image_header(head)
+            if len(head) >= HEADER_SCAN_LIMIT:
+                break
+    finally:
+        stream.seek(0)
+    if header is None:
+        raise UploadRejected(415, "Could not read the image header")
+
+    image_format, width, height = header
+    if width == 0 or height == 0:
+        raise UploadRejected(415, "Image has no pixels")
+    if width > MAX_IMAGE_SIDE or height > MAX_IMAGE_SIDE or width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected(413, f"Image dimensions {width}x{height} exceed the allowed limit")
+    return image_format, width, height
@@ -0,0 +1,152 @@
+"""
+Load benchmark: the old single-threaded SimpleHTTPRequestHandler server versus serve.py.
+
+    python bench_serve.py --clients 16 --duration 10 --slow-clients 1
+
+Each server runs in its own process. Clients fetch a browser-like mix of pages
+and heavy assets; with --revalidate a fraction of requests carries the
+validators from an earlier response, as a returning visitor's browser would.
+--slow-clients opens connections that trickle their request, which is what
+stalls a single-threaded server.
+"""
+import argparse
+import http.client
+import http.server
+import multiprocessing
+import os
+import random
+import socket
+import socketserver
+import statistics
+import threading
+import time
+import urllib.parse
+
+import serve
+
+ASSETS = [
+    "/index.html", "/app.html", "/landing.css", "/styles.css", "/script.js",
+    "/image 1.gif", "/vidhi.png", "/slide1.webp", "/slide2.webp", "/slide 4.jpg",
+]
+
+
+def run_legacy_server(port, ready):
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    os.chdir(serve.ROOT)
+    socketserver.TCPServer.allow_reuse_address = True
+    with socketserver.TCPServer(("", port), QuietHandler) as httpd:
+        ready.set()
+        httpd.serve_forever()
+
+
+def run_new_server(port, ready):
+    with serve.build_server(port, quiet=True) as httpd:
+        ready.set()
+        httpd.serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def slow_client(port, stop):
+    """Sends one header byte per second, holding its connection open."""
+    while not stop.is_set():
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=60) as sock:
+                for byte in b"GET /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n":
+                    if stop.is_set():
+                        return
+                    sock.sendall(bytes([byte]))
+                    time.sleep(1)
+                sock.recv(65536)
+        except OSError:
+            time.sleep(0.1)
+
+
+def worker(port, deadline, revalidate, results):
+    # Like a browser, reuse one connection; http.client reconnects whenever the
+    # server closes it (the old server speaks HTTP/1.0 and always does).
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    validators = {}
+    while time.perf_counter() < deadline:
+        path = random.choice(ASSETS)
+        headers = {"Accept-Encoding": "br, gzip"}
+        if path in validators and random.random() < revalidate:
+            etag, last_modified = validators[path]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        started = time.perf_counter()
+        try:
+            conn.request("GET", urllib.parse.quote(path), headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            results.append((path, time.perf_counter() - started, None, 0))
+            continue
+        validators[path] = (response.getheader("ETag"), response.getheader("Last-Modified"))
+        results.append((path, time.perf_counter() - started, response.status, len(body)))
+    conn.close()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def benchmark(name, target, args):
+    port = free_port()
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=target, args=(port, ready), daemon=True)
+    process.start()
+    ready.wait(30)
+
+    stop = threading.Event()
+    slow = [threading.Thread(target=slow_client, args=(port, stop), daemon=True) for _ in range(args.slow_clients)]
+    for thread in slow:
+        thread.start()
+    time.sleep(0.2)
+
+    results = []
+    deadline = time.perf_counter() + args.duration
+    clients = [threading.Thread(target=worker, args=(port, deadline, args.revalidate, results)) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    process.terminate()
+    process.join()
+
+    ok = [r for r in results if r[2] is not None and r[2] < 400]
+    latencies = [r[1] * 1000 for r in ok] or [0.0]
+    print(f"\n{name}")
+    print(f"  requests: {len(results)}  ok: {len(ok)}  errors: {len(results) - len(ok)}")
+    print(f"  throughput: {len(ok) / elapsed:.1f} req/s, {sum(r[3] for r in ok) / elapsed / 1e6:.1f} MB/s")
+    print(f"  latency ms: p50 {percentile(latencies, 50):.1f}  p95 {percentile(latencies, 95):.1f}  "
+          f"p99 {percentile(latencies, 99):.1f}  mean {statistics.mean(latencies):.1f}")
+    print(f"  304 Not Modified: {sum(1 for r in ok if r[2] == 304)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per server")
+    parser.add_argument("--revalidate", type=float, default=0.5, help="Fraction of repeat fetches sent with validators")
+    parser.add_argument("--slow-clients", type=int, default=0, help="Connections that trickle their request")
+    args = parser.parse_args()
+
+    benchmark("socketserver.TCPServer + SimpleHTTPRequestHandler (old)", run_legacy_server, args)
+    benchmark("serve.py threaded cached server (new)", run_new_server, args)
@@ -1,14 +1,243 @@
+import argparse
+import email.utils
+import gzip
+import hashlib
 import http.server
-import socketserver
+import mimetypes
+import os
+import re
+import threading
+import urllib.parse
+
+try:
+    import brotli  # Optional: pip install brotli to also serve .br variants
+except ImportError:
+    brotli = None
 
 PORT = 8000
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Files whose names carry a content hash (e.g. app.3f2a9c1b.js) never change,
+# so browsers may keep them for a year. Everything else is revalidated via ETag.
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# A compressed variant is only kept if it is meaningfully smaller; images such
+# as GIF/PNG/WebP are already compressed and are served as-is.
+MIN_COMPRESSION_SAVING = 0.05
+
+
+class CachedFile:
+    """A static file held in memory with its precompressed variants."""
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            body = f.read()
+
+        self.mtime = stat.st_mtime
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type.startswith("text/") or self.content_type.endswith(("javascript", "json")):
+            self.content_type += "; charset=utf-8"
+        self.cache_control = IMMUTABLE_CACHE if FINGERPRINT_RE.search(path) else REVALIDATE_CACHE
+
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        # Each encoding gets its own strong ETag, since the bytes differ.
+        self.variants = {"identity": (body, f'"{digest}"')}
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            if len(data) <= len(body) * (1 - MIN_COMPRESSION_SAVING):
+                self.variants[encoding] = (data, f'"{digest}-{encoding}"')
+
+    def etags(self):
+        return {etag for _, etag in self.variants.values()}
+
+
+class FileCache:
+    """Loads every file under ROOT at startup and reloads any that change on disk."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.lock = threading.Lock()
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if not name.startswith("."):
+                    self.get(os.path.join(dirpath, name))
+
+    def get(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        cached = self.files.get(path)
+        if cached is None or cached.mtime != mtime:
+            with self.lock:
+                cached = self.files.get(path)
+                if cached is None or cached.mtime != mtime:
+                    cached = CachedFile(path)
+                    self.files[path] = cached
+        return cached
+
+
+def parse_range(header, size):
+    """Returns (start, end) for a single 'bytes=' range, None if absent, or 'invalid'."""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None  # Multipart ranges are rare for static assets; send the full body
+    start, _, end = spec.partition("-")
+    try:
+        if start == "":
+            length = int(end)
+            if length == 0:
+                return "invalid"
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "invalid"
+    return start, min(end, size - 1)
+
+
+class StaticHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "SpinalScanStatic/1.0"
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; don't let Nagle hold the body back.
+    disable_nagle_algorithm = True
+    cache = None
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def resolve(self):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        full_path = os.path.realpath(os.path.join(self.cache.root, path.lstrip("/")))
+        if full_path != self.cache.root and not full_path.startswith(self.cache.root + os.sep):
+            return None
+        if os.path.isdir(full_path):
+            full_path = os.path.join(full_path, "index.html")
+        return full_path
+
+    def choose_encoding(self, cached):
+        accepted = self.headers.get("Accept-Encoding", "")
+        tokens = {token.split(";")[0].strip() for token in accepted.split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in tokens and encoding in cached.variants:
+                return encoding
+        return "identity"
+
+    def not_modified(self, cached):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            return "*" in tags or bool(tags & cached.etags())
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(cached.mtime) <= since
+        return False
+
+    def serve(self, send_body):
+        full_path = self.resolve()
+        cached = self.cache.get(full_path) if full_path else None
+        if cached is None:
+            self.send_error(404, "File not found")
+            return
+
+        encoding = self.choose_encoding(cached)
+        body, etag = cached.variants[encoding]
+
+        if self.not_modified(cached):
+            self.send_response(304)
+            self.send_common_headers(cached, etag)
+            self.end_headers()
+            return
+
+        # Byte ranges always refer to the identity encoding.
+        byte_range = None
+        if "Range" in self.headers:
+            identity_body, identity_etag = cached.variants["identity"]
+            if_range = self.headers.get("If-Range")
+            if if_range is None or if_range == identity_etag:
+                byte_range = parse_range(self.headers["Range"], len(identity_body))
+            if byte_range is not None:
+                encoding, body, etag = "identity", identity_body, identity_etag
+
+        if byte_range == "invalid":
+            self.send_response(416)
+            self.send_common_headers(cached, etag)
+            self.send_header("Content-Range", f"bytes */{len(body)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if byte_range is not None:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+
+        self.send_common_headers(cached, etag)
+        self.send_header("Content-Type", cached.content_type)
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_common_headers(self, cached, etag):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", cached.last_modified)
+        self.send_header("Cache-Control", cached.cache_control)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Vary", "Accept-Encoding")
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class StaticServer(http.server.ThreadingHTTPServer):
+    # One thread per connection, so a slow client no longer stalls everyone else.
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+    quiet = False
+
+
+def build_server(port=PORT, root=ROOT, quiet=False):
+    handler = type("Handler", (StaticHandler,), {"cache": FileCache(os.path.realpath(root))})
+    httpd = StaticServer(("", port), handler)
+    httpd.quiet = quiet
+    return httpd
 
-Handler = http.server.SimpleHTTPRequestHandler
 
-with socketserver.TCPServer(("", PORT), Handler) as httpd:
-    print("\n=======================================================")
-    print(f"  Frontend server is running at http://127.0.0.1:{PORT}")
-    print("  Open this URL in your browser to see your app.")
-    print("=======================================================\n")
-    httpd.serve_forever()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the SpinalScan frontend.")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--quiet", action="store_true", help="Don't log every request")
+    args = parser.parse_args()
 
+    with build_server(args.port, quiet=args.quiet) as httpd:
+        print("\n=======================================================")
+        print(f"  Frontend server is running at http://127.0.0.1:{args.port}")
+        print("  Open this URL in your browser to see your app.")
+        print("=======================================================\n")
+        httpd.serve_forever()